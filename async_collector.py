@@ -0,0 +1,259 @@
+from prometheus_client.exposition import generate_latest
+
+import asyncio
+import functools
+import greenlet
+import httpx
+import io
+import logging
+import requests
+import sys
+import time
+
+from collector import RedfishMetricsCollector
+from limiter import AdaptiveLimit, THROTTLED, THROTTLED_ATTEMPTS, limiter_eviction
+from transport import store_peer_certificate
+
+_limiters = {}
+_eviction = limiter_eviction(_limiters)
+
+class _AsyncioGreenlet(greenlet.greenlet):
+    """Greenlet running synchronous collector code on behalf of a coroutine."""
+
+    def __init__(self, function, driver):
+        greenlet.greenlet.__init__(self, function, driver)
+        self.driver = driver
+
+
+def await_only(awaitable):
+    """Waits for an awaitable from synchronous code started with greenlet_spawn."""
+    current = greenlet.getcurrent()
+    if not isinstance(current, _AsyncioGreenlet):
+        raise RuntimeError("await_only() called outside of greenlet_spawn()")
+
+    # hand the awaitable to the coroutine driving this greenlet and wait for its result
+    return current.driver.switch(awaitable)
+
+
+async def greenlet_spawn(function, *args, **kwargs):
+    """Runs synchronous code as a coroutine, each await_only in it suspends the coroutine."""
+    context = _AsyncioGreenlet(function, greenlet.getcurrent())
+    result = context.switch(*args, **kwargs)
+
+    while not context.dead:
+        try:
+            value = await result
+        except BaseException:
+            result = context.throw(*sys.exc_info())
+        else:
+            result = context.switch(value)
+
+    return result
+
+
+class GreenletLock(object):
+    """Lock of the greenlets of one scrape, waiting for it suspends the greenlet instead of blocking the event loop."""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    def __enter__(self):
+        await_only(self._lock.acquire())
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+
+class AsyncTargetLimiter(AdaptiveLimit):
+    """The asyncio counterpart of limiter.TargetLimiter."""
+
+    def __init__(self, target, limit):
+        super().__init__(target, limit)
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            while True:
+                pause = self.pause()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                elif self._in_flight >= self.current:
+                    await self._condition.wait()
+                else:
+                    break
+
+            self._in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def record_async(self, status_code, duration, retry_after=None):
+        async with self._condition:
+            self.record(status_code, duration, retry_after)
+            self._condition.notify_all()
+
+
+def get_limiter(target, limit):
+    # the asyncio counterpart of limiter.get_limiter, only used from the event loop
+    _eviction.run()
+
+    limiter = _limiters.get(target)
+    if not limiter or limiter.max_limit != limit:
+        limiter = AsyncTargetLimiter(target, limit)
+        _limiters[target] = limiter
+
+    return limiter
+
+
+class AsyncRedfishMetricsCollector(RedfishMetricsCollector):
+    """RedfishMetricsCollector sending its requests with a shared asyncio HTTP client."""
+
+    def __init__(self, config, target, host, usr, pwd, metrics_type, client, modules=None):
+        super().__init__(config, target, host, usr, pwd, metrics_type, modules=modules)
+        self._client = client
+        self._async_limiter = get_limiter(target, self._max_workers)
+        # the login of one greenlet awaits its request, the others must not hold up the event loop meanwhile
+        self._login_lock = GreenletLock()
+
+    def _request(self, method, url, stream=False, auth=None, **kwargs):
+        return await_only(self._async_request(method, url, auth=auth, **kwargs))
+
+    async def _async_request(self, method, url, auth=None, **kwargs):
+        for attempt in range(1, THROTTLED_ATTEMPTS + 1):
+            response = await self._send(method, url, auth=auth, **kwargs)
+
+            # an overloaded server is asked again after the pause it asked for
+            if response.status_code not in THROTTLED or attempt == THROTTLED_ATTEMPTS or self._async_limiter.pause() > self._timeout:
+                break
+
+            logging.warning(f"Target {self.target}: Server {self.host} is overloaded ({response.status_code}), retrying in {round(self._async_limiter.pause(), 1)} seconds")
+
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.reason = response.reason_phrase
+        result.headers = requests.structures.CaseInsensitiveDict(response.headers)
+        result.url = str(response.url)
+        result.encoding = response.encoding
+        result._content = response.content
+        result.raw = io.BytesIO(response.content)
+
+        return result
+
+    async def _send(self, method, url, auth=None, **kwargs):
+        try:
+            async with self._async_limiter:
+                start = time.time()
+                try:
+                    response = await self._client.request(
+                        method, url, auth=auth, timeout=self._timeout, **kwargs
+                    )
+                except httpx.TimeoutException:
+                    await self._async_limiter.record_async(408, time.time() - start)
+                    raise
+
+        # the collector expects the exceptions of the requests module
+        except httpx.ConnectTimeout as err:
+            raise requests.exceptions.ConnectTimeout(err)
+        except httpx.TimeoutException as err:
+            raise requests.exceptions.ReadTimeout(err)
+        except httpx.TransportError as err:
+            raise requests.exceptions.ConnectionError(err)
+
+        await self._async_limiter.record_async(
+            response.status_code, time.time() - start, response.headers.get("Retry-After")
+        )
+
+        # remember the certificate of the server for the certificate metrics
+        network_stream = response.extensions.get("network_stream")
+        ssl_object = network_stream.get_extra_info("ssl_object") if network_stream else None
+        if ssl_object:
+            store_peer_certificate(self.target, ssl_object.getpeercert(binary_form=True))
+
+        return response
+
+    def _run_blocking(self, function):
+        return await_only(asyncio.get_running_loop().run_in_executor(None, function))
+
+    def fetch_all(self, commands):
+        # every fetch is its own coroutine, the per-target semaphore limits the parallel requests
+        return await_only(asyncio.gather(
+            *(greenlet_spawn(self.connect_server, command) for command in commands)
+        ))
+
+    def run_all(self, functions):
+        return await_only(asyncio.gather(*(greenlet_spawn(function) for function in functions)))
+
+
+def _collect(config, target, host, usr, pwd, metrics_type, client, modules=None):
+    with AsyncRedfishMetricsCollector(
+        config,
+        target = target,
+        host = host,
+        usr = usr,
+        pwd = pwd,
+        metrics_type = metrics_type,
+        client = client,
+        modules = modules
+    ) as registry:
+
+        # open a session with the remote board
+        registry.get_session()
+
+        # collect the actual metrics
+        return generate_latest(registry)
+
+
+def _collect_families(config, target, host, usr, pwd, metrics_type, client):
+    with AsyncRedfishMetricsCollector(
+        config,
+        target = target,
+        host = host,
+        usr = usr,
+        pwd = pwd,
+        metrics_type = metrics_type,
+        client = client
+    ) as registry:
+
+        # open a session with the remote board
+        registry.get_session()
+
+        # the families have to be collected before the session is closed
+        return list(registry.collect_batch())
+
+
+async def collect_metrics(config, target, host, usr, pwd, metrics_type, client, modules=None):
+    """Scrapes one server as a coroutine and returns the metrics in the Prometheus text format."""
+    return await greenlet_spawn(
+        functools.partial(_collect, config, target, host, usr, pwd, metrics_type, client, modules)
+    )
+
+
+async def collect_metric_families(config, target, host, usr, pwd, metrics_type, client):
+    """Scrapes one server as a coroutine and returns its metric families, including redfish_up."""
+    return await greenlet_spawn(
+        functools.partial(_collect_families, config, target, host, usr, pwd, metrics_type, client)
+    )
+
+
+def create_client(config):
+    """Returns the HTTP client shared by all scrapes of the asyncio engine."""
+    max_connections = int(config.get("async_max_connections", 1000))
+    idle_timeout = int(config.get("connection_idle_timeout", 300))
+
+    return httpx.AsyncClient(
+        verify=False,
+        headers={"charset": "utf-8", "content-type": "application/json"},
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=idle_timeout,
+        ),
+    )
@@ -0,0 +1,146 @@
+import falcon
+import asyncio
+import logging
+import traceback
+
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+from prometheus_client.exposition import generate_latest
+
+from handler import welcomePage, exporterMetricsHandler, tracesHandler, targetsHandler, metricsHandler, batchHandler
+from handler import resolve_target, get_credentials, down_metrics, merge_metric_families
+from handler import StaticCollector
+from async_collector import collect_metrics, collect_metric_families
+from dns_cache import get_dns_cache
+from singleflight import AsyncSingleFlight, coalesced_requests
+
+class asyncWelcomePage(welcomePage):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class asyncExporterMetricsHandler(exporterMetricsHandler):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class asyncTracesHandler(tracesHandler):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class asyncTargetsHandler(targetsHandler):
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class asyncMetricsHandler(metricsHandler):
+    def __init__(self, config, metrics_type, client, poller=None):
+        super().__init__(config, metrics_type, poller=poller)
+        self._client = client
+        self._single_flight = AsyncSingleFlight()
+
+    async def on_get(self, req, resp):
+        target, job = self._get_params(req)
+        modules = self._get_modules(req)
+
+        resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
+
+        # targets polled in the background are answered from memory
+        if self._poller and not modules:
+            output = self._poller.get_metrics(target, job, self.metrics_type)
+            if output:
+                logging.debug(f"Target {target}: Serving polled {self.metrics_type} metrics.")
+                resp.text = output
+                resp.status = falcon.HTTP_200
+                return
+
+        # identical scrapes arriving at the same time share one scrape of the server
+        output, shared = await self._single_flight.do(
+            (target, self.metrics_type, job, modules),
+            lambda: self._scrape(target, job, modules)
+        )
+        if shared:
+            logging.debug(f"Target {target}: Answered with the result of a running {self.metrics_type} scrape.")
+            coalesced_requests.labels(self.metrics_type).inc()
+
+        resp.text = output
+        resp.status = falcon.HTTP_200
+
+    async def _scrape(self, target, job, modules=None):
+        # the resolver is blocking, don't stop the event loop for it
+        target, host = await asyncio.get_running_loop().run_in_executor(None, resolve_target, target, self._dns_cache)
+        usr, pwd = get_credentials(self._config, job, target)
+
+        try:
+            return await collect_metrics(
+                self._config,
+                target = target,
+                host = host,
+                usr = usr,
+                pwd = pwd,
+                metrics_type = self.metrics_type,
+                client = self._client,
+                modules = modules
+            )
+
+        except Exception:
+            message = f"Exception: {traceback.format_exc()}"
+            logging.error(f"Target {target}: {message}")
+            raise falcon.HTTPBadRequest("Bad Request", message)
+
+
+class asyncBatchHandler(batchHandler):
+    def __init__(self, config, client):
+        self._config = config
+        self._client = client
+        self._dns_cache = get_dns_cache(config)
+
+        # one semaphore for all batch calls limits the scrapes running at the same time
+        self._semaphore = asyncio.Semaphore(int(config.get("batch_concurrency", 32)))
+
+    async def on_get(self, req, resp):
+        targets, job, metrics_type = self._get_params(req)
+
+        results = await asyncio.gather(
+            *(self._scrape(target, job, metrics_type) for target in targets)
+        )
+        metrics = merge_metric_families(results)
+
+        resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        resp.text = b"".join(generate_latest(StaticCollector([metric])) for metric in metrics)
+        resp.status = falcon.HTTP_200
+
+    async def _scrape(self, target, job, metrics_type):
+        # a failing server must not fail the whole batch, it is reported with redfish_up 0
+        try:
+            async with self._semaphore:
+                target_ip, host = await asyncio.get_running_loop().run_in_executor(None, resolve_target, target, self._dns_cache)
+                usr, pwd = get_credentials(self._config, job, target)
+
+                return await collect_metric_families(
+                    self._config,
+                    target = target_ip,
+                    host = host,
+                    usr = usr,
+                    pwd = pwd,
+                    metrics_type = metrics_type,
+                    client = self._client
+                )
+
+        except falcon.HTTPError as err:
+            logging.error(f"Target {target}: Batch scrape failed: {err.description}")
+
+        except Exception:
+            logging.error(f"Target {target}: Batch scrape failed: {traceback.format_exc()}")
+
+        return down_metrics(target)
+
+
+class clientLifecycle:
+    """Closes the shared HTTP client when the ASGI server shuts down."""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def process_shutdown(self, scope, event):
+        await self._client.aclose()
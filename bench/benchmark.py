@@ -0,0 +1,191 @@
+"""Benchmark of RedfishMetricsCollector against mock BMCs serving the recorded fixtures.
+
+    python bench/benchmark.py --iterations 20 --latency 0.05 --jitter 0.02
+
+Every fixture is served from its own process, so the peak RSS is the one of the exporter code.
+"""
+
+from prometheus_client.exposition import generate_latest
+
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import warnings
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collector import RedfishMetricsCollector
+from session_pool import SessionPool
+from mock_bmc import MockBMC, list_fixtures
+
+METRICS_TYPES = ["health", "firmware", "performance"]
+
+
+def _serve(fixture, options, connection):
+    # runs in a child process, answers the number of requests since the last call
+    bmc = MockBMC(fixture, **options).start()
+    connection.send(bmc.target)
+
+    while connection.recv() == "requests":
+        connection.send(len(bmc.reset()))
+
+    bmc.stop()
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * percent / 100) - 1, 0)]
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def scrape(config, target, metrics_type, session_pool):
+    start = time.time()
+    with RedfishMetricsCollector(
+        config,
+        target = target,
+        host = target,
+        usr = config["username"],
+        pwd = config["password"],
+        metrics_type = metrics_type,
+        session_pool = session_pool
+    ) as registry:
+        registry.get_session()
+        output = generate_latest(registry)
+        up = registry.up_metrics().samples[0].value
+
+    return time.time() - start, len(output), up
+
+
+def run(config, fixture, metrics_type, args, connection, session_pool):
+    target = config["target"]
+    durations = []
+    requests = []
+    failures = 0
+    size = 0
+
+    wall_start = time.time()
+    for iteration in range(args.warmup + args.iterations):
+        connection.send("requests")
+        connection.recv()
+
+        results = []
+
+        def worker():
+            try:
+                results.append(scrape(config, target, metrics_type, session_pool))
+            except Exception as err:
+                logging.error(f"Target {target}: {fixture} {metrics_type} scrape failed: {err}")
+
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        connection.send("requests")
+        request_count = connection.recv()
+
+        if iteration < args.warmup:
+            wall_start = time.time()
+            continue
+
+        requests.append(request_count / args.concurrency)
+        for duration, size, up in results:
+            durations.append(duration)
+            if not up:
+                failures += 1
+        failures += args.concurrency - len(results)
+
+    return {
+        "fixture": fixture,
+        "metrics_type": metrics_type,
+        "scrapes": len(durations),
+        "failures": failures,
+        "requests_per_scrape": round(sum(requests) / len(requests), 1),
+        "wall_seconds": round(time.time() - wall_start, 3),
+        "p50_seconds": round(percentile(durations, 50), 3) if durations else None,
+        "p99_seconds": round(percentile(durations, 99), 3) if durations else None,
+        "output_bytes": size,
+        "peak_rss_mib": round(peak_rss_mib(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collector against mock BMCs")
+    parser.add_argument("-f", "--fixtures", default=",".join(list_fixtures()), help="Comma separated list of fixtures")
+    parser.add_argument("-t", "--types", default=",".join(METRICS_TYPES), help="Comma separated list of metrics types")
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("-w", "--warmup", type=int, default=0, help="Iterations not counted, e.g. to fill the caches")
+    parser.add_argument("-j", "--concurrency", type=int, default=1, help="Scrapes of the same server at the same time")
+    parser.add_argument("-c", "--config", help="Exporter config file, e.g. to switch off $expand or the cache")
+    parser.add_argument("--session-pool", action="store_true", help="Keep the sessions between the scrapes")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request of the mock BMC")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with 503")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests the mock BMC takes at once, more are answered with 503")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to a JSON file")
+    parser.add_argument("-d", "--debug", action="store_true")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+
+    config = {}
+    if args.config:
+        with open(args.config) as config_file:
+            config = yaml.load(config_file.read(), Loader=yaml.FullLoader)
+    config.update({"username": "admin", "password": "admin"})
+
+    results = []
+    print(f"{'fixture':16} {'type':12} {'scrapes':>7} {'failed':>6} {'req/scrape':>10} {'wall s':>8} {'p50 s':>7} {'p99 s':>7} {'peak RSS MiB':>12}")
+
+    for fixture in args.fixtures.split(","):
+        connection, child_connection = multiprocessing.Pipe()
+        options = {
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "max_concurrency": args.max_concurrency,
+        }
+        server = multiprocessing.Process(target=_serve, args=(fixture, options, child_connection), daemon=True)
+        server.start()
+        config["target"] = connection.recv()
+
+        session_pool = None
+        if args.session_pool:
+            session_pool = SessionPool(ttl=300, max_per_target=args.concurrency, timeout=10)
+
+        for metrics_type in args.types.split(","):
+            result = run(config, fixture, metrics_type, args, connection, session_pool)
+            results.append(result)
+            print(
+                f"{fixture:16} {metrics_type:12} {result['scrapes']:>7} {result['failures']:>6} "
+                f"{result['requests_per_scrape']:>10} {result['wall_seconds']:>8} "
+                f"{str(result['p50_seconds']):>7} {str(result['p99_seconds']):>7} {result['peak_rss_mib']:>12}"
+            )
+
+        if session_pool:
+            session_pool.close()
+
+        connection.send("stop")
+        server.join()
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Micro-benchmark of the JSON decoding of the recorded Redfish payloads.
+
+    python bench/decode_benchmark.py --iterations 200
+
+Every resource of a fixture is decoded as the server sends it, collections also as the
+$expand=.($levels=2) answer, with the json module, with orjson and with the selective mode.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import decoder
+from mock_bmc import expand, list_fixtures, load_fixture
+
+
+def payloads(fixture):
+    resources = load_fixture(fixture)["Resources"]
+    result = [json.dumps(document).encode() for document in resources.values()]
+    result += [
+        json.dumps(expand(resources, document, 2)).encode()
+        for document in resources.values()
+        if "Members" in document
+    ]
+    return result
+
+
+def decoders():
+    result = {"json": json.loads}
+    if decoder.orjson:
+        result["orjson"] = decoder.orjson.loads
+    result["json selective"] = lambda data: decoder.project(json.loads(data))
+    if decoder.orjson:
+        result["orjson selective"] = lambda data: decoder.project(decoder.orjson.loads(data))
+    return result
+
+
+def measure(loads, documents, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for data in documents:
+            loads(data)
+    seconds = (time.perf_counter() - start) / iterations
+
+    # memory of the decoded documents while they are all kept, like in the response cache
+    tracemalloc.start()
+    decoded = [loads(data) for data in documents]
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del decoded
+
+    return seconds, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decoding of the recorded Redfish payloads")
+    parser.add_argument("-f", "--fixtures", default=",".join(list_fixtures()), help="Comma separated list of fixtures")
+    parser.add_argument("-n", "--iterations", type=int, default=100)
+    parser.add_argument("--json", metavar="FILE", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    if not decoder.orjson:
+        print("orjson is not installed, only the json module is measured")
+
+    results = []
+    print(f"{'fixture':14} {'decoder':18} {'payloads':>8} {'KiB':>8} {'ms/pass':>8} {'MiB/s':>8} {'kept KiB':>9}")
+
+    for fixture in args.fixtures.split(","):
+        documents = payloads(fixture)
+        size = sum(len(data) for data in documents)
+
+        for name, loads in decoders().items():
+            seconds, kept = measure(loads, documents, args.iterations)
+            result = {
+                "fixture": fixture,
+                "decoder": name,
+                "payloads": len(documents),
+                "payload_bytes": size,
+                "ms_per_pass": round(seconds * 1000, 3),
+                "mib_per_second": round(size / seconds / 2**20, 1),
+                "kept_bytes": kept,
+            }
+            results.append(result)
+            print(
+                f"{fixture:14} {name:18} {len(documents):>8} {size / 1024:>8.1f} "
+                f"{result['ms_per_pass']:>8} {result['mib_per_second']:>8} {kept / 1024:>9.1f}"
+            )
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
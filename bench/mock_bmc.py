@@ -0,0 +1,428 @@
+"""Mock Redfish BMC serving a recorded resource tree over HTTPS.
+
+Run it on its own to point the exporter at it:
+
+    python bench/mock_bmc.py --fixture dell_idrac9 --port 443 --latency 0.05
+
+It needs the cryptography package for its certificate, see bench/requirements.txt.
+"""
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import os
+import queue
+import random
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+EVENT_SERVICE = {
+    "@odata.id": "/redfish/v1/EventService",
+    "Id": "EventService",
+    "Name": "Event Service",
+    "ServiceEnabled": True,
+    "ServerSentEventUri": "/redfish/v1/EventService/SSE",
+}
+
+
+def list_fixtures():
+    return sorted(name[:-5] for name in os.listdir(FIXTURES_DIR) if name.endswith(".json"))
+
+
+def load_fixture(name):
+    """Returns the recorded fixture with its resources by URL, a fixture with a base only overrides its resources."""
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json")) as fixture_file:
+        fixture = json.load(fixture_file)
+
+    if "base" in fixture:
+        base = load_fixture(fixture["base"])
+        resources = dict(base["Resources"], **fixture.get("Resources", {}))
+        fixture = dict(base, **fixture)
+        fixture["Resources"] = resources
+
+    return fixture
+
+
+def is_link(value):
+    # a link only has annotations like @odata.id or @odata.etag
+    return isinstance(value, dict) and "@odata.id" in value and all(key.startswith("@odata.") for key in value)
+
+
+def etag(document):
+    return '"' + hashlib.md5(json.dumps(document, sort_keys=True).encode()).hexdigest() + '"'
+
+
+def annotate(resources, document):
+    """Adds the @odata.etag of the resource and of the members in its collection, like some BMCs do."""
+    document = dict(document, **{"@odata.etag": etag(document)})
+    if isinstance(document.get("Members"), list):
+        document["Members"] = [
+            dict(member, **{"@odata.etag": etag(resources[member["@odata.id"]])})
+            if is_link(member) and member["@odata.id"] in resources else member
+            for member in document["Members"]
+        ]
+
+    return document
+
+
+def expand(resources, document, levels):
+    """Replaces the links below the resource with the resources, like $expand=.($levels=n)."""
+    if levels <= 0:
+        return document
+
+    def walk(value, top):
+        if isinstance(value, dict):
+            if not top and is_link(value) and value["@odata.id"] in resources:
+                return expand(resources, resources[value["@odata.id"]], levels - 1)
+            return {key: item if key == "Links" else walk(item, False) for key, item in value.items()}
+        if isinstance(value, list):
+            return [walk(item, False) for item in value]
+        return value
+
+    return walk(document, True)
+
+
+def _create_certificate(directory):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    with open(cert_file, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+
+    return cert_file, key_file
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body=None, headers=None):
+        self._finish()
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, code, message):
+        self._send(code, {"error": {"code": "Base.1.0.GeneralError", "message": message}})
+
+    def _authorized(self):
+        bmc = self.server.bmc
+        token = self.headers.get("X-Auth-Token")
+        if token and token in bmc.sessions:
+            return True
+
+        authorization = self.headers.get("Authorization", "")
+        if authorization.startswith("Basic "):
+            return base64.b64decode(authorization[6:]).decode() == f"{bmc.username}:{bmc.password}"
+
+        return False
+
+    def _begin(self):
+        # count the request and apply the configured latency and errors
+        bmc = self.server.bmc
+        bmc.record(self.command, self.path)
+
+        with bmc.lock:
+            bmc.in_flight += 1
+            self._in_flight = True
+            overloaded = bmc.max_concurrency and bmc.in_flight > bmc.max_concurrency
+
+        # like a BMC that can't take more requests
+        if overloaded:
+            self._send(503, {"error": {"code": "Base.1.0.ServiceTemporarilyUnavailable", "message": "Too many requests"}},
+                       {"Retry-After": str(bmc.retry_after)})
+            return False
+
+        delay = bmc.latency + random.uniform(-bmc.jitter, bmc.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if bmc.error_rate and random.random() < bmc.error_rate:
+            self._error(503, "Injected error")
+            return False
+
+        return True
+
+    def _finish(self):
+        # the request no longer counts for max_concurrency
+        if getattr(self, "_in_flight", False):
+            self._in_flight = False
+            with self.server.bmc.lock:
+                self.server.bmc.in_flight -= 1
+
+    def do_GET(self):
+        if not self._begin():
+            return
+
+        bmc = self.server.bmc
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+
+        if path not in bmc.resources and path != EVENT_SERVICE["ServerSentEventUri"]:
+            return self._error(404, f"Resource {path} not found")
+        if path != "/redfish/v1" and not self._authorized():
+            return self._error(401, "Unauthorized")
+        if path == EVENT_SERVICE["ServerSentEventUri"]:
+            return self._stream_events()
+
+        document = bmc.resources[path]
+        if bmc.member_etags:
+            document = annotate(bmc.resources, document)
+        expand_query = parse_qs(url.query).get("$expand")
+        if expand_query:
+            levels = 1
+            if "$levels=" in expand_query[0]:
+                levels = int(expand_query[0].split("$levels=")[1].rstrip(")"))
+            document = expand(bmc.resources, document, levels)
+
+        headers = {}
+        if bmc.etag:
+            document_etag = etag(document)
+            if self.headers.get("If-None-Match") == document_etag:
+                return self._send(304, headers={"ETag": document_etag})
+            headers["ETag"] = document_etag
+
+        self._send(200, document, headers)
+
+    def _stream_events(self):
+        # server sent events until the client or the mock server goes away
+        self._finish()
+        bmc = self.server.bmc
+        events = queue.Queue()
+        with bmc.lock:
+            bmc.subscribers.append(events)
+
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        try:
+            while not bmc.stopped.is_set():
+                try:
+                    event = events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                if event is None:
+                    break
+                self.wfile.write(f"id: {event['Id']}\ndata: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+
+        except OSError:
+            pass
+
+        finally:
+            with bmc.lock:
+                bmc.subscribers.remove(events)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = json.loads(self.rfile.read(length) or b"{}")
+        if not self._begin():
+            return
+
+        bmc = self.server.bmc
+        if not self.path.startswith("/redfish/v1/SessionService/Sessions"):
+            return self._error(405, "Method not allowed")
+        if data.get("UserName") != bmc.username or data.get("Password") != bmc.password:
+            return self._error(401, "Invalid username or password")
+
+        token = uuid.uuid4().hex
+        session_url = f"/redfish/v1/SessionService/Sessions/{token[:12]}"
+        with bmc.lock:
+            bmc.sessions[token] = session_url
+
+        self._send(
+            201,
+            {"@odata.id": session_url, "Id": token[:12], "Name": "User Session", "UserName": bmc.username},
+            {"X-Auth-Token": token, "Location": session_url},
+        )
+
+    def do_DELETE(self):
+        if not self._begin():
+            return
+
+        bmc = self.server.bmc
+        token = self.headers.get("X-Auth-Token")
+        with bmc.lock:
+            session_url = bmc.sessions.get(token)
+            if session_url == self.path:
+                del bmc.sessions[token]
+
+        if session_url != self.path:
+            return self._error(404, "Session not found")
+
+        self._send(204)
+
+
+class MockBMC(object):
+    """HTTPS server answering Redfish requests from a fixture with configurable latency, jitter and errors.
+
+    With max_concurrency, requests above that many at the same time are answered with 503 and Retry-After.
+    """
+
+    def __init__(self, fixture, latency=0.0, jitter=0.0, error_rate=0.0, max_concurrency=0, retry_after=1,
+                 username="admin", password="admin", host="127.0.0.1", port=0):
+        if isinstance(fixture, str):
+            fixture = load_fixture(fixture)
+
+        self.resources = dict(fixture["Resources"])
+        self.resources.setdefault(EVENT_SERVICE["@odata.id"], EVENT_SERVICE)
+        self.etag = fixture.get("etag", True)
+        self.member_etags = fixture.get("member_etags", False)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.username = username
+        self.password = password
+
+        self.sessions = {}
+        self.requests = []
+        self.subscribers = []
+        self.event_id = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self._server = _Server((host, port), _Handler)
+        self._server.bmc = self
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        with tempfile.TemporaryDirectory() as directory:
+            context.load_cert_chain(*_create_certificate(directory))
+
+        # the handshake runs in the request thread, not in the accepting one
+        self._server.socket = context.wrap_socket(
+            self._server.socket, server_side=True, do_handshake_on_connect=False
+        )
+        self.port = self._server.server_address[1]
+        self.target = f"{host}:{self.port}"
+
+    def record(self, method, path):
+        with self.lock:
+            self.requests.append((method, path))
+
+    def reset(self):
+        # returns the requests since the last reset
+        with self.lock:
+            requests, self.requests = self.requests, []
+
+        return requests
+
+    def send_event(self, origin, message_id="ResourceEvent.1.0.ResourceChanged", severity="Warning"):
+        # sends an event about the resource to all open event streams
+        with self.lock:
+            self.event_id += 1
+            event = {
+                "@odata.type": "#Event.v1_4_0.Event",
+                "Id": str(self.event_id),
+                "Name": "Event",
+                "Events": [{
+                    "EventId": str(self.event_id),
+                    "EventType": "Alert",
+                    "MessageId": message_id,
+                    "Severity": severity,
+                    "OriginOfCondition": {"@odata.id": origin},
+                }],
+            }
+            for events in self.subscribers:
+                events.put(event)
+
+    def close_event_streams(self):
+        with self.lock:
+            for events in self.subscribers:
+                events.put(None)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="mock-bmc", daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a recorded Redfish tree over HTTPS")
+    parser.add_argument("-f", "--fixture", choices=list_fixtures(), default="hpe_ilo5")
+    parser.add_argument("-p", "--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random variation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with 503")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Answer requests above this many at once with 503")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    args = parser.parse_args()
+
+    bmc = MockBMC(
+        args.fixture,
+        latency = args.latency,
+        jitter = args.jitter,
+        error_rate = args.error_rate,
+        max_concurrency = args.max_concurrency,
+        username = args.username,
+        password = args.password,
+        host = "0.0.0.0",
+        port = args.port,
+    )
+    print(f"Serving {args.fixture} on https://{bmc.target}")
+    try:
+        bmc.serve_forever()
+    except KeyboardInterrupt:
+        pass
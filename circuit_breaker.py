@@ -0,0 +1,113 @@
+from prometheus_client import Counter, Gauge
+
+import logging
+import threading
+import time
+
+from idle_eviction import IdleEviction, IDLE_TIMEOUT
+
+breaker_state = Gauge(
+    "redfish_exporter_circuit_breaker_state",
+    "State of the circuit breaker of a target (0 closed, 1 open, 2 half-open)",
+    ["target"],
+)
+rejected_scrapes = Counter(
+    "redfish_exporter_circuit_breaker_rejected_scrapes",
+    "Scrapes answered with redfish_up 0 without asking the server because its circuit breaker is open",
+    ["target"],
+)
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+# last http codes of the exporter for servers which did not answer at all
+UNREACHABLE = (408, 444)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+class CircuitBreaker(object):
+    """Stops asking a server after failure_threshold failed scrapes in a row, until a probe after the cooldown succeeds."""
+
+    def __init__(self, target, failure_threshold, cooldown):
+        self.target = target
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self._opened = 0
+        self._probe_started = 0
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+        breaker_state.labels(target).set(CLOSED)
+
+    def allow(self):
+        # True if the scrape may ask the server, only one scrape at a time probes an open breaker
+        with self._lock:
+            now = time.time()
+            self.last_used = now
+            if self.state == CLOSED:
+                return True
+
+            # a probe that never reported back does not keep the breaker half-open forever
+            if self.state == OPEN and now - self._opened >= self.cooldown or \
+                    self.state == HALF_OPEN and now - self._probe_started >= self.cooldown:
+                logging.info(f"Target {self.target}: Probing the server after {round(now - self._opened)} seconds")
+                self._set_state(HALF_OPEN)
+                self._probe_started = now
+                return True
+
+        rejected_scrapes.labels(self.target).inc()
+        return False
+
+    def record(self, success):
+        with self._lock:
+            if success:
+                if self.state != CLOSED:
+                    logging.info(f"Target {self.target}: Server answers again, closing the circuit breaker")
+                self.failures = 0
+                self._set_state(CLOSED)
+                return
+
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logging.warning(
+                        f"Target {self.target}: Server did not answer {self.failures} times in a row, "
+                        f"skipping it for {self.cooldown} seconds"
+                    )
+                self._opened = time.time()
+                self._set_state(OPEN)
+
+    def _set_state(self, state):
+        self.state = state
+        breaker_state.labels(self.target).set(state)
+
+
+# an open breaker is kept at least for its cooldown
+_eviction = IdleEviction(
+    _breakers,
+    lambda breaker, now: now - breaker.last_used > max(IDLE_TIMEOUT, breaker.cooldown),
+    [breaker_state, rejected_scrapes],
+)
+
+
+def get_circuit_breaker(config, target):
+    # all scrapes of the same target share one breaker, None if it is switched off
+    settings = config.get("circuit_breaker", {})
+    failure_threshold = int(settings.get("failure_threshold", 3))
+    cooldown = int(settings.get("cooldown", 60))
+
+    if failure_threshold < 1:
+        return None
+
+    with _breakers_lock:
+        _eviction.run()
+
+        breaker = _breakers.get(target)
+        if not breaker or breaker.failure_threshold != failure_threshold or breaker.cooldown != cooldown:
+            breaker = CircuitBreaker(target, failure_threshold, cooldown)
+            _breakers[target] = breaker
+
+        return breaker
@@ -0,0 +1,179 @@
+from prometheus_client import Counter, Gauge
+
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+shard_targets = Gauge(
+    "redfish_exporter_cluster_targets",
+    "Configured targets the hash ring assigns to this replica",
+)
+ring_replicas = Gauge(
+    "redfish_exporter_cluster_replicas",
+    "Replicas on the hash ring",
+)
+moved_targets = Counter(
+    "redfish_exporter_cluster_moved_targets",
+    "Targets this replica took over (gained) or handed to another one (lost) when the replicas changed",
+    ["direction"],
+)
+
+# seconds between two checks of the membership file
+MEMBERSHIP_CHECK_INTERVAL = 5
+
+_cluster = None
+_cluster_lock = threading.Lock()
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing(object):
+    """Consistent-hash ring with virtual_nodes points per replica, a target belongs to the replica of the next point."""
+
+    def __init__(self, replicas, virtual_nodes):
+        self.replicas = sorted(set(replicas))
+        # a replica joining or leaving only moves the targets next to its own points
+        points = sorted(
+            (_hash(f"{replica}#{number}"), replica) for replica in self.replicas for number in range(virtual_nodes)
+        )
+        self._points = [point for point, replica in points]
+        self._replicas = [replica for point, replica in points]
+
+    def owner(self, target):
+        if not self._points:
+            return None
+
+        index = bisect.bisect(self._points, _hash(target)) % len(self._points)
+        return self._replicas[index]
+
+
+class Cluster(object):
+    """Shares the configured targets between the exporter replicas, the replicas come from the config or a membership file."""
+
+    def __init__(self, replica, replicas, membership_file, virtual_nodes, targets):
+        self.replica = replica
+        self.membership_file = membership_file
+        self.virtual_nodes = virtual_nodes
+        self.targets = targets
+        self._ring = None
+        self._shard = []
+        self._mtime = None
+        self._checked = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+        # the replicas of the config are used until the membership file can be read
+        self._current()
+        if not self._ring:
+            self._update(replicas)
+
+    def owns(self, target):
+        """Returns True if the hash ring assigns the target to this replica."""
+        return self._current().owner(target) == self.replica
+
+    def subscribe(self, callback):
+        """Calls callback with the new shard whenever the replicas change, it must not call back into the cluster."""
+        self._subscribers.append(callback)
+
+    def shard(self):
+        """Returns the configured targets of this replica as (target, job, labels) tuples."""
+        self._current()
+        return self._shard
+
+    def _current(self):
+        # the membership file is read again when it changed, replicas join or leave by editing it
+        if not self.membership_file:
+            return self._ring
+
+        with self._lock:
+            now = time.time()
+            if now - self._checked < MEMBERSHIP_CHECK_INTERVAL:
+                return self._ring
+            self._checked = now
+
+            try:
+                mtime = os.stat(self.membership_file).st_mtime
+                if mtime != self._mtime:
+                    with open(self.membership_file) as members:
+                        replicas = [
+                            line.split("#")[0].strip() for line in members if line.split("#")[0].strip()
+                        ]
+                    self._mtime = mtime
+                    self._update(replicas)
+
+            except OSError as err:
+                # a missing file keeps the last known replicas
+                logging.error(f"Cluster: Failed to read the membership file {self.membership_file}: {err}")
+
+            return self._ring
+
+    def _update(self, replicas):
+        ring = HashRing(replicas, self.virtual_nodes)
+        if self._ring and ring.replicas == self._ring.replicas:
+            return
+
+        shard = [entry for entry in self.targets if ring.owner(entry[0]) == self.replica]
+        if self._ring:
+            before = set(entry[0] for entry in self._shard)
+            after = set(entry[0] for entry in shard)
+            moved_targets.labels("gained").inc(len(after - before))
+            moved_targets.labels("lost").inc(len(before - after))
+            logging.info(
+                f"Cluster: {len(ring.replicas)} replicas, {self.replica} has {len(shard)} of {len(self.targets)} targets "
+                f"({len(after - before)} gained, {len(before - after)} lost)"
+            )
+        else:
+            logging.info(f"Cluster: {len(ring.replicas)} replicas, {self.replica} has {len(shard)} of {len(self.targets)} targets")
+
+        if self.replica not in ring.replicas:
+            logging.warning(f"Cluster: {self.replica} is not one of the replicas, it has no targets")
+
+        self._ring = ring
+        self._shard = shard
+        shard_targets.set(len(shard))
+        ring_replicas.set(len(ring.replicas))
+
+        for callback in self._subscribers:
+            callback(shard)
+
+
+def _targets(config, entries):
+    # entries are names or dicts with target, job and labels like the polling targets
+    targets = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"target": entry}
+        # Prometheus only takes strings as label values, e.g. rack: 3 in the YAML file is a number
+        labels = {name: str(value) for name, value in entry.get("labels", {}).items()}
+        targets.append((entry["target"], entry.get("job", config.get("job")), labels))
+
+    return targets
+
+
+def get_cluster(config):
+    # one ring for the whole exporter, None if the exporter runs alone
+    global _cluster
+
+    settings = config.get("cluster", {})
+    if not settings.get("replicas") and not settings.get("membership_file"):
+        return None
+
+    with _cluster_lock:
+        if not _cluster:
+            port = int(os.getenv("LISTEN_PORT", config.get("listen_port", 9200)))
+            replica = os.getenv("CLUSTER_REPLICA", settings.get("replica", f"{socket.getfqdn()}:{port}"))
+
+            _cluster = Cluster(
+                replica,
+                replicas = settings.get("replicas", []),
+                membership_file = settings.get("membership_file"),
+                virtual_nodes = int(settings.get("virtual_nodes", 100)),
+                targets = _targets(config, settings.get("targets", config.get("polling", {}).get("targets", []))),
+            )
+
+        return _cluster
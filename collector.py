@@ -1,22 +1,51 @@
+from prometheus_client import Counter, Histogram
 from prometheus_client.core import GaugeMetricFamily
 
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import logging
 import os
+import threading
 import time
 import sys
 import re
+import decoder
+from circuit_breaker import get_circuit_breaker, UNREACHABLE
+from limiter import get_limiter, THROTTLED, THROTTLED_ATTEMPTS
+from firmware_state import get_firmware_state_store
+from response_cache import get_response_cache, resource_class
+from session_pool import active_sessions
+from tracing import Trace, get_trace_store, traced
+from transport import get_transport
 from collectors.performance_collector import PerformanceCollector
 from collectors.firmware_collector import FirmwareCollector
 from collectors.health_collector import HealthCollector
 from collectors.certificate_collector import CertificateCollector
 
+bmc_request_duration = Histogram(
+    "redfish_exporter_bmc_request_duration_seconds",
+    "Duration of the requests to the Redfish API by server and resource class",
+    ["host", "resource_class"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+bmc_requests = Counter(
+    "redfish_exporter_bmc_requests",
+    "Requests to the Redfish API by server and HTTP status code",
+    ["host", "code"],
+)
+bmc_received_bytes = Counter(
+    "redfish_exporter_bmc_received_bytes",
+    "Bytes received from the Redfish API by server",
+    ["host"],
+)
+
 class RedfishMetricsCollector(object):
 
     def __enter__(self):
         return self
 
-    def __init__(self, config, target, host, usr, pwd, metrics_type):
+    def __init__(self, config, target, host, usr, pwd, metrics_type, session_pool=None, modules=None):
         self.target = target
         self.host = host
 
@@ -24,9 +53,28 @@ class RedfishMetricsCollector(object):
         self._password = pwd
         
         self.metrics_type = metrics_type
+        # the metrics types collected, several of them for the metrics type "all"
+        self.modules = modules or [metrics_type]
         self.collect_certificates = bool(config.get('collect_certificates', False))
+        self._certificate_cache_ttl = int(config.get('certificate_cache_ttl', 86400))
 
         self._timeout = int(os.getenv("TIMEOUT", config.get('timeout', 10)))
+        self._use_expand = bool(config.get('expand', True))
+        self._selective_decoding = bool(config.get('selective_decoding', False))
+        self._expand = False
+        self._expand_max_levels = 0
+        self._max_workers = int(config.get('max_concurrent_requests', 4))
+        self._limiter = get_limiter(self.target, self._max_workers)
+        self._circuit_breaker = get_circuit_breaker(config, self.target)
+        self._transport = get_transport(config, self.target)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._cache = get_response_cache(config)
+        # documents read by several modules of a scrape are only fetched once
+        self._memo = {} if len(self.modules) > 1 else None
+        self._trace_store = get_trace_store(config)
+        self.firmware_states = get_firmware_state_store(config)
+        self.trace = Trace(self.target, self.host, self.metrics_type)
         self.labels = {"host": self.host}
         self._redfish_up = 0
         self._response_time = 0
@@ -69,9 +117,45 @@ class RedfishMetricsCollector(object):
         self._auth_token = ""
         self._basic_auth = False
         self._session = ""
+        self._session_pool = session_pool
+        self._pooled = None
+        self._reauthenticated = False
+        self._login_lock = threading.Lock()
         self.redfish_version = "not available"
 
+    @traced("get_session")
     def get_session(self):
+        # a server that did not answer the last scrapes is not asked again until the cooldown is over
+        if self._circuit_breaker and not self._circuit_breaker.allow():
+            logging.warning(f"Target {self.target}: Server {self.host} did not answer the last scrapes, skipping it.")
+            return
+
+        self._open_session()
+
+        if self._circuit_breaker:
+            # a server answering with an error is reachable, only timeouts and connection errors count
+            self._circuit_breaker.record(self._redfish_up == 1 or self._last_http_code not in UNREACHABLE)
+
+    def _load_stored(self):
+        if self._cache and not self._cache.loaded(self.target):
+            self._cache.load(self.target)
+        if self.firmware_states and not self.firmware_states.loaded(self.target):
+            self.firmware_states.load(self.target)
+
+    def _open_session(self):
+        # the data of the target from before a restart is read from disk outside of the event loop of the asyncio engine
+        if self._cache and not self._cache.loaded(self.target) or \
+                self.firmware_states and not self.firmware_states.loaded(self.target):
+            self._run_blocking(self._load_stored)
+
+        # reuse a session from an earlier scrape if there is one
+        if self._session_pool:
+            self._pooled = self._session_pool.acquire(self.target, self._username)
+            if self._pooled:
+                self._session = self._pooled.session
+                self._auth_token = self._pooled.auth_token
+                self._session_url = self._pooled.session_url
+
         # Get the url for the server info and messure the response time
         logging.info(f"Target {self.target}: Connecting to server {self.host}")
         start_time = time.time()
@@ -82,12 +166,25 @@ class RedfishMetricsCollector(object):
 
         if not server_response:
             logging.warning(f"Target {self.target}: No data received from server {self.host}!")
+            if self._pooled:
+                # don't try to delete the session on a server that does not answer
+                self._session_pool.discard(self._pooled, "unreachable")
+                self._auth_token = ""
+                self._session = ""
             return
 
         logging.debug(f"Target {self.target}: data received from server {self.host}.")
 
         if "RedfishVersion" in server_response:
             self.redfish_version = server_response['RedfishVersion']
+
+        # check if collections can be fetched together with their members
+        expand_query = server_response.get("ProtocolFeaturesSupported", {}).get("ExpandQuery", {})
+        if self._use_expand and expand_query.get("NoLinks"):
+            self._expand = True
+            if expand_query.get("Levels"):
+                self._expand_max_levels = expand_query.get("MaxLevels", 1)
+            logging.debug(f"Target {self.target}: Server supports $expand, max levels: {self._expand_max_levels}")
         
         for key in ["Systems", "SessionService"]:
             if key in server_response:
@@ -96,6 +193,15 @@ class RedfishMetricsCollector(object):
                 logging.warning(f"Target {self.target}: No {key} URL found on server {self.host}!")
                 return
 
+        if self._pooled:
+            logging.info(f"Target {self.target}: Reusing pooled session with server {self.host}.")
+            self._redfish_up = 1
+            return
+
+        self._login()
+
+    @traced("login")
+    def _login(self):
         session_service = self.connect_server(
             self.urls['SessionService'], 
             basic_auth=True
@@ -108,26 +214,22 @@ class RedfishMetricsCollector(object):
 
         sessions_url = f"https://{self.target}{session_service['Sessions']['@odata.id']}"
         session_data = {"UserName": self._username, "Password": self._password}
-        self._session.auth = None
         result = ""
 
         # Try to get a session
         try:
-            result = self._session.post(
-                sessions_url, json=session_data, verify=False, timeout=self._timeout
-            )
+            result = self._request("POST", sessions_url, json=session_data)
             result.raise_for_status()
 
         except requests.exceptions.ConnectionError as err:
             logging.warning(f"Target {self.target}: Failed to get an auth token from server {self.host}. Retrying ...")
             try:
-                result = self._session.post(
-                    sessions_url, json=session_data, verify=False, timeout=self._timeout
-                )
+                result = self._request("POST", sessions_url, json=session_data)
                 result.raise_for_status()
 
             except requests.exceptions.ConnectionError as err:
                 logging.error(f"Target {self.target}: Error getting an auth token from server {self.host}: {err}")
+                self._last_http_code = 444
                 self._basic_auth = True
 
         except requests.exceptions.HTTPError as err:
@@ -138,15 +240,51 @@ class RedfishMetricsCollector(object):
         except requests.exceptions.ReadTimeout as err:
             logging.warning(f"Target {self.target}: No session received from server {self.host}: {err}")
             logging.warning(f"Target {self.target}: Switching to basic authentication.")
+            self._last_http_code = 408
             self._basic_auth = True
 
         if result:
             if result.status_code in [200, 201]:
                 self._auth_token = result.headers['X-Auth-Token']
+                active_sessions.inc()
                 self._session_url = result.json()['@odata.id']
                 logging.info(f"Target {self.target}: Got an auth token from server {self.host}!")
                 self._redfish_up = 1
 
+    def _request(self, method, url, **kwargs):
+        # all requests to the server go through here, the asyncio engine replaces it
+        if not self._session:
+            # the connections to the server are kept open for the next scrapes
+            self._session = requests.Session()
+            self._session.mount("https://", self._transport)
+            self._session.verify = False
+            self._session.headers.update({"charset": "utf-8"})
+            self._session.headers.update({"content-type": "application/json"})
+        else:
+            logging.debug(f"Target {self.target}: Using existing session.")
+
+        for attempt in range(1, THROTTLED_ATTEMPTS + 1):
+            with self._limiter:
+                start = time.time()
+                try:
+                    response = self._session.request(method, url, verify=False, timeout=self._timeout, **kwargs)
+                except requests.exceptions.Timeout:
+                    self._limiter.record(408, time.time() - start)
+                    raise
+
+            self._limiter.record(response.status_code, time.time() - start, response.headers.get("Retry-After"))
+
+            # an overloaded server is asked again after the pause it asked for
+            if response.status_code not in THROTTLED or attempt == THROTTLED_ATTEMPTS or self._limiter.pause() > self._timeout:
+                return response
+
+            logging.warning(f"Target {self.target}: Server {self.host} is overloaded ({response.status_code}), retrying in {round(self._limiter.pause(), 1)} seconds")
+            response.close()
+
+    def _run_blocking(self, function):
+        # blocking socket calls which are not requests to the Redfish API
+        return function()
+
     def connect_server(self, command, noauth=False, basic_auth=False):
         logging.captureWarnings(True)
 
@@ -159,33 +297,56 @@ class RedfishMetricsCollector(object):
 
         url = f"https://{self.target}{command}"
 
-        # check if we already established a session with the server
-        if not self._session:
-            self._session = requests.Session()
-        else:
-            logging.debug(f"Target {self.target}: Using existing session.")
-
-        self._session.verify = False
-        self._session.headers.update({"charset": "utf-8"})
-        self._session.headers.update({"content-type": "application/json"})
+        # token and credentials are sent per request, the session is shared by the fetch threads
+        headers = {}
+        auth = None
+        auth_token = self._auth_token
 
         if noauth:
             logging.debug(f"Target {self.target}: Using no auth")
         elif basic_auth or self._basic_auth:
-            self._session.auth = (self._username, self._password)
+            auth = (self._username, self._password)
             logging.debug(f"Target {self.target}: Using basic auth with user {self._username}")
         else:
             logging.debug(f"Target {self.target}: Using auth token")
-            self._session.auth = None
-            self._session.headers.update({"X-Auth-Token": self._auth_token})
+            headers["X-Auth-Token"] = auth_token
+
+        if self._memo is not None and not noauth and command in self._memo:
+            logging.debug(f"Target {self.target}: Using response of this scrape for {url}")
+            return self._memo[command]
+
+        # answer from the cache if the resource is still fresh, otherwise ask the server if it changed
+        cached = None
+        if self._cache and not noauth:
+            cached, fresh = self._cache.get(self.target, command)
+            if fresh:
+                logging.debug(f"Target {self.target}: Using cached response for {url}")
+                return cached.data
+
+            if cached and cached.etag:
+                headers["If-None-Match"] = cached.etag
 
         logging.debug(f"Target {self.target}: Using URL {url}")
         try:
-            req = self._session.get(url, stream=True, timeout=self._timeout)
+            req = self._request("GET", url, stream=True, headers=headers, auth=auth)
             req.raise_for_status()
 
         except requests.exceptions.HTTPError as err:
             self._last_http_code = err.response.status_code
+            if err.response.status_code == 401 and auth_token and not (noauth or basic_auth or self._basic_auth):
+                # the session timed out on the server or was removed, get a new one once
+                with self._login_lock:
+                    if self._auth_token == auth_token and not self._reauthenticated:
+                        logging.warning(f"Target {self.target}: Session no longer valid on server {self.host}. Logging in again ...")
+                        self._reauthenticated = True
+                        self._auth_token = ""
+                        active_sessions.dec()
+                        self._login()
+
+                if self._auth_token and self._auth_token != auth_token:
+                    self._count_request(command, req, request_start)
+                    return self.connect_server(command, noauth, basic_auth)
+
             if err.response.status_code == 401:
                 logging.error(f"Target {self.target}: Authorization Error: Wrong job provided or user/password set wrong on server {self.host}: {err}")
             else:
@@ -206,18 +367,31 @@ class RedfishMetricsCollector(object):
             logging.error(f"Target {self.target}: Unexpected error: {sys.exc_info()[0]}")
             self._last_http_code = 500
 
-        if req != "":
+        if req != "" and req.status_code == 304 and cached:
+            # read the empty body, otherwise the connection is not put back into the pool
+            req.content
+            self._last_http_code = 200
+            self._cache.revalidated(self.target, command, cached)
+            server_response = cached.data
+
+        elif req != "":
             self._last_http_code = req.status_code
             try:
-                req_text = req.json()
+                req_text = decoder.loads(req.content)
 
             except:
                 logging.debug(f"Target {self.target}: No json data received.")
 
             # req will evaluate to True if the status code was between 200 and 400 and False otherwise.
             if req:
+                if self._selective_decoding and isinstance(req_text, dict):
+                    req_text = decoder.project(req_text)
                 server_response = req_text
 
+                if self._cache and not noauth and isinstance(req_text, dict):
+                    etag = req.headers.get("ETag") or req_text.get("@odata.etag")
+                    self._cache.put(self.target, command, req_text, etag, len(req.content))
+
             # if the request fails the server might give a hint in the ExtendedInfo field
             else:
                 if req_text:
@@ -238,8 +412,69 @@ class RedfishMetricsCollector(object):
 
         request_duration = round(time.time() - request_start, 2)
         logging.debug(f"Target {self.target}: Request duration: {request_duration}")
+        self._count_request(command, req, request_start)
+
+        if self._memo is not None and not noauth and server_response:
+            self._memo[command] = server_response
+
         return server_response
 
+    def _count_request(self, command, req, request_start):
+        bmc_request_duration.labels(self.host, resource_class(command)).observe(time.time() - request_start)
+        if req != "":
+            bmc_requests.labels(self.host, str(req.status_code)).inc()
+            bmc_received_bytes.labels(self.host).inc(len(req.content))
+        else:
+            bmc_requests.labels(self.host, str(self._last_http_code)).inc()
+
+    def fetch_all(self, commands):
+        # fetch several resources in parallel, the results keep the order of the commands
+        commands = list(commands)
+        if len(commands) < 2 or self._max_workers < 2:
+            return [self.connect_server(command) for command in commands]
+
+        # the parts of a scrape running at the same time share the executor
+        with self._executor_lock:
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_workers, thread_name_prefix=f"redfish-{self.target}"
+                )
+
+        return list(self._executor.map(self.connect_server, commands))
+
+    def run_all(self, functions):
+        # run independent parts of a scrape at the same time, their requests count against the same limit of the target
+        functions = list(functions)
+        if len(functions) < 2 or self._max_workers < 2:
+            return [function() for function in functions]
+
+        with ThreadPoolExecutor(
+            max_workers=len(functions), thread_name_prefix=f"redfish-{self.target}-phase"
+        ) as executor:
+            futures = [executor.submit(function) for function in functions]
+            return [future.result() for future in futures]
+
+    def get_collection(self, command, levels=1):
+        # let the server inline the members (and their sub-resources) if it supports $expand
+        if self._expand and self._expand_max_levels:
+            command = f"{command}?$expand=.($levels={min(levels, self._expand_max_levels)})"
+        elif self._expand:
+            command = f"{command}?$expand=."
+
+        return self.connect_server(command)
+
+    def is_link(self, member):
+        # a link only has annotations like @odata.id or @odata.etag, a member inlined by $expand also has properties
+        return all(key.startswith("@odata.") for key in member)
+
+    def resolve_links(self, links):
+        # fetch the resources behind the links, links already expanded by the server are used as they are
+        links = list(links)
+        fetched = iter(self.fetch_all(link["@odata.id"] for link in links if self.is_link(link)))
+
+        return [next(fetched) if self.is_link(link) else link for link in links]
+
+    @traced("get_base_labels")
     def get_base_labels(self):
         systems = self.connect_server(self.urls['Systems'])
 
@@ -283,6 +518,7 @@ class RedfishMetricsCollector(object):
 
         self.get_chassis_urls()
 
+    @traced("get_chassis_urls")
     def get_chassis_urls(self):
         chassis_data = self.connect_server(self.urls['Chassis'])
         if not chassis_data:
@@ -297,20 +533,44 @@ class RedfishMetricsCollector(object):
         return chassis_data
     
 
+    def collect_health_phases(self, phases):
+        # read some parts of the health data again, e.g. after an event of the server
+        if self._redfish_up == 0:
+            return None
+
+        self.get_base_labels()
+
+        metrics = HealthCollector(self)
+        metrics.collect(phases)
+
+        return [metrics.mem_metrics_correctable, metrics.mem_metrics_unorrectable, metrics.health_metrics]
+
+    def up_metrics(self):
+        up_metrics = GaugeMetricFamily(
+            f"redfish_up",
+            "Redfish Server Monitoring availability",
+            labels = self.labels,
+        )
+        up_metrics.add_sample(
+            f"redfish_up", 
+            value = self._redfish_up, 
+            labels = dict(self.labels)
+        )
+        return up_metrics
+
+    def collect_batch(self):
+        # batch scrapes report the availability of every server, whatever the metrics type
+        if self.metrics_type not in ['health', 'all']:
+            yield self.up_metrics()
+
+        yield from self.collect()
+
     def collect(self):
-        if self.metrics_type == 'health':
-            up_metrics = GaugeMetricFamily(
-                f"redfish_up",
-                "Redfish Server Monitoring availability",
-                labels = self.labels,
-            )
-            up_metrics.add_sample(
-                f"redfish_up", 
-                value = self._redfish_up, 
-                labels = self.labels
-            )
-            yield up_metrics
+        # the combined scrape reports the availability also without the health module
+        if 'health' in self.modules or self.metrics_type == 'all':
+            yield self.up_metrics()
 
+        if 'health' in self.modules:
             version_metrics = GaugeMetricFamily(
                 f"redfish_version",
                 "Redfish Server Monitoring redfish version",
@@ -333,7 +593,7 @@ class RedfishMetricsCollector(object):
             response_metrics.add_sample(
                 f"redfish_response_duration_seconds",
                 value = self._response_time,
-                labels = self.labels,
+                labels = dict(self.labels),
             )
             yield response_metrics
             
@@ -342,11 +602,14 @@ class RedfishMetricsCollector(object):
 
         self.get_base_labels()
 
-        if self.metrics_type == 'health':
+        if 'health' in self.modules:
 
             if self.collect_certificates:
-                cert_metrics = CertificateCollector(self.host, self.target, self.labels)
-                cert_metrics.collect()
+                cert_metrics = CertificateCollector(
+                    self.host, self.target, self.labels, self._timeout, self._certificate_cache_ttl
+                )
+                with self.trace.span("certificates"):
+                    self._run_blocking(cert_metrics.collect)
 
                 yield cert_metrics.cert_metrics_isvalid
                 yield cert_metrics.cert_metrics_valid_hostname
@@ -371,20 +634,22 @@ class RedfishMetricsCollector(object):
             yield metrics.health_metrics
 
         # Get the firmware information
-        if self.metrics_type == 'firmware':
+        if 'firmware' in self.modules:
             metrics = FirmwareCollector(self)
             metrics.collect()
                 
             yield metrics.fw_metrics
 
         # Get the performance information
-        if self.metrics_type == 'performance':
+        if 'performance' in self.modules:
             metrics = PerformanceCollector(self)
             metrics.collect()
             
             yield metrics.power_metrics
             yield metrics.temperature_metrics
 
+        yield self.phase_metrics()
+
         # Finish with calculating the scrape duration
         duration = round(time.time() - self._start_time, 2)
         logging.info(f"Target {self.target}: {self.metrics_type} scrape duration: {duration} seconds")
@@ -402,7 +667,48 @@ class RedfishMetricsCollector(object):
         )
         yield scrape_metrics
 
+    def phase_metrics(self):
+        # the session is deleted after the metrics are sent, so the logout is only in the trace history
+        phase_metrics = GaugeMetricFamily(
+            f"redfish_{self.metrics_type}_phase_duration_seconds",
+            f"Redfish Server Monitoring redfish {self.metrics_type} scrape phase duration in seconds",
+            labels = self.labels,
+        )
+
+        # a phase can run several times in one scrape, e.g. once per batch of fetches, its durations are added up
+        durations = {}
+        for phase, duration in self.trace.phases():
+            durations[phase] = durations.get(phase, 0) + duration
+
+        for phase, duration in durations.items():
+            phase_labels = {"phase": phase}
+            phase_labels.update(self.labels)
+            phase_metrics.add_sample(
+                f"redfish_{self.metrics_type}_phase_duration_seconds",
+                value = round(duration, 3),
+                labels = phase_labels,
+            )
+        return phase_metrics
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+
+        try:
+            self._close_session()
+        finally:
+            self.trace.finish()
+            if self._trace_store:
+                self._trace_store.add(self.trace)
+
+    def _close_session(self):
+        if self._session_pool and self._auth_token:
+            logging.debug(f"Target {self.target}: Keeping Redfish session with server {self.host} for the next scrape")
+            self._session_pool.release(
+                self.target, self._username, self._session, self._auth_token, self._session_url
+            )
+            return
+
         logging.debug(f"Target {self.target}: Deleting Redfish session with server {self.host}")
 
         if self._auth_token:
@@ -411,10 +717,10 @@ class RedfishMetricsCollector(object):
 
             logging.debug(f"Target {self.target}: Using URL {session_url}")
 
-            response = requests.delete(
-                session_url, verify=False, timeout=self._timeout, headers=headers
-            )
-            response.close()
+            with self.trace.span("delete_session"):
+                response = self._request("DELETE", session_url, headers=headers)
+                response.close()
+            active_sessions.dec()
 
             if response:
                 logging.info(f"Target {self.target}: Redfish Session deleted successfully.")
@@ -5,13 +5,40 @@ import ssl
 import OpenSSL
 import socket
 import datetime
+import hashlib
+import threading
+import time
+
+from idle_eviction import IdleEviction, IDLE_TIMEOUT
+from transport import peer_certificate
+
+# target -> the certificate it presented the last time, parsed
+_certificates = {}
+_certificates_lock = threading.Lock()
+
+class CertificateInfo(object):
+    """The fields of a server certificate the metrics are made of."""
+
+    def __init__(self, fingerprint, subject, issuer, not_after):
+        self.fingerprint = fingerprint
+        self.subject = subject
+        self.issuer = issuer
+        self.not_after = not_after
+        self.checked = time.time()
+        self.last_used = self.checked
+
+
+# certificates of targets that are no longer scraped are removed
+_eviction = IdleEviction(_certificates, lambda certificate, now: now - certificate.last_used > IDLE_TIMEOUT)
+
 
 class CertificateCollector(object):
 
-    def __init__(self, host, target, labels):
+    def __init__(self, host, target, labels, timeout=10, cache_ttl=86400):
         self.host = host
         self.target = target
-        self.timeout = 10
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
         self.labels = labels
         self.port = 443
 
@@ -36,12 +63,44 @@ class CertificateCollector(object):
             labels = self.labels,
         )
 
+    def get_certificate(self):
+        # certificates change rarely, they are only parsed again if the fingerprint differs
+        with _certificates_lock:
+            _eviction.run()
+            cached = _certificates.get(self.target)
+            if cached:
+                cached.last_used = time.time()
+
+        # the certificate of the connection to the Redfish API, a new connection is only opened if there is none
+        cert = peer_certificate(self.target)
+        if not cert:
+            if cached and time.time() - cached.checked < self.cache_ttl:
+                return cached
+
+            cert = ssl.PEM_cert_to_DER_cert(ssl.get_server_certificate((self.host, self.port), timeout=self.timeout))
+
+        fingerprint = hashlib.sha256(cert).hexdigest()
+        if cached and cached.fingerprint == fingerprint:
+            cached.checked = time.time()
+            return cached
+
+        logging.debug(f"Target {self.target}: Parsing certificate with fingerprint {fingerprint}")
+        x509 = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_ASN1, cert)
+        subject = [value.decode('utf-8') for name, value in x509.get_subject().get_components() if name.decode('utf-8') == 'CN'][0]
+        issuer = [value.decode('utf-8') for name, value in x509.get_issuer().get_components() if name.decode('utf-8') == 'CN'][0]
+        not_after = datetime.datetime.strptime(x509.get_notAfter().decode('utf-8'), '%Y%m%d%H%M%S%fZ') if x509.get_notAfter().decode('utf-8') else None
+
+        certificate = CertificateInfo(fingerprint, subject, issuer, not_after)
+        with _certificates_lock:
+            _certificates[self.target] = certificate
+
+        return certificate
+
     def collect(self):
 
         logging.info(f"Target {self.target}: Collecting data ...")
 
-        cert = None
-        x509 = None
+        certificate = None
         cert_days_left = 0
         cert_valid = 0
         cert_has_right_hostname = 0
@@ -53,19 +112,18 @@ class CertificateCollector(object):
         }
 
         try:
-            cert = ssl.get_server_certificate((self.host, self.port))
-            x509 = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, cert)
+            certificate = self.get_certificate()
 
-        except OpenSSL.SSL.Error as e:
+        except (OpenSSL.SSL.Error, OpenSSL.crypto.Error, OSError) as e:
 
             logging.debug(f"Target {self.target}: Certificate Validation Error!")
             logging.debug(f"Target {self.target}: {e}")
 
-        if cert and x509:
-            subject = [value.decode('utf-8') for name, value in x509.get_subject().get_components() if name.decode('utf-8') == 'CN'][0]
-            issuer = [value.decode('utf-8') for name, value in x509.get_issuer().get_components() if name.decode('utf-8') == 'CN'][0]
+        if certificate:
+            subject = certificate.subject
+            issuer = certificate.issuer
 
-            cert_expiry_date = datetime.datetime.strptime(x509.get_notAfter().decode('utf-8'), '%Y%m%d%H%M%S%fZ') if x509.get_notAfter().decode('utf-8') else datetime.datetime.now()
+            cert_expiry_date = certificate.not_after or datetime.datetime.now()
             cert_days_left = (cert_expiry_date - datetime.datetime.now()).days
             current_labels.update(
                 {
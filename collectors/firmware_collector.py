@@ -1,8 +1,12 @@
 from prometheus_client.core import GaugeMetricFamily
 
 import logging
+import time
 from re import search
 
+from firmware_state import FirmwareState, firmware_items
+from tracing import traced
+
 class FirmwareCollector(object):
 
     def __enter__(self):
@@ -11,6 +15,7 @@ class FirmwareCollector(object):
     def __init__(self, redfish_metrics_collector):
 
         self.col = redfish_metrics_collector
+        self.trace = self.col.trace
 
         self.fw_metrics = GaugeMetricFamily(
             "redfish_firmware",
@@ -18,46 +23,98 @@ class FirmwareCollector(object):
             labels=self.col.labels,
         )
 
+    @traced("firmware")
     def collect(self):
 
         logging.info(f"Target {self.col.target}: Get the firmware information.")
 
-        fw_collection = self.col.connect_server(
+        fw_collection = self.col.get_collection(
             "/redfish/v1/UpdateService/FirmwareInventory"
         )
         if not fw_collection:
             logging.warning(f"Target {self.target}: Cannot get Firmware data!")
             return
 
-        for fw_member in fw_collection['Members']:
-            fw_member_url = fw_member['@odata.id']
-            # only look at entries on a Dell server if the device is markedd as installed
-            if (search(".*Dell.*", self.col.manufacturer) and ("Installed" in fw_member_url)) or not search(".*Dell.*", self.col.manufacturer):
-                fw_item = self.col.connect_server(fw_member_url)
-                if not fw_item:
-                    continue
-
-                item_name = fw_item['Name'].split(",", 1)[0]
-                current_labels = {"item_name": item_name}
-
-                if self.col.manufacturer == 'Lenovo':
-                    # Lenovo has always Firmware: in front of the names, let's remove it
-                    item_name = fw_item['Name'].replace('Firmware:','')
-                    current_labels.update({"item_name": item_name})
-                    # we need an additional label to distinguish the metrics because
-                    # the device ID is not in the name in case of Lenovo
-                    if "Id" in fw_item:
-                        current_labels.update({"item_id": fw_item['Id']})
-
-                if "Manufacturer" in fw_item:
-                    current_labels.update({"item_manufacturer": fw_item['Manufacturer']})
-
-                if "Version" in fw_item:
-                    version = fw_item['Version']
-                    if version != "N/A" and version != None:
-                        current_labels.update({"version": version})
-                        current_labels.update(self.col.labels)
-                        self.fw_metrics.add_sample("redfish_firmware", value=1, labels=current_labels)
+        # only look at entries on a Dell server if the device is markedd as installed
+        fw_members = [
+            fw_member
+            for fw_member in fw_collection['Members']
+            if (search(".*Dell.*", self.col.manufacturer) and ("Installed" in fw_member['@odata.id'])) or not search(".*Dell.*", self.col.manufacturer)
+        ]
+
+        if self.col.firmware_states:
+            items = self.get_items_incremental(fw_members)
+        else:
+            items = [self.get_item_labels(fw_item) for fw_item in self.col.resolve_links(fw_members)]
+
+        for item_labels in items:
+            if item_labels:
+                current_labels = dict(item_labels)
+                current_labels.update(self.col.labels)
+                self.fw_metrics.add_sample("redfish_firmware", value=1, labels=current_labels)
+
+    def get_item_labels(self, fw_item):
+        # labels of the sample of a firmware item, None if it has no version
+        if not fw_item:
+            return None
+
+        item_name = fw_item['Name'].split(",", 1)[0]
+        current_labels = {"item_name": item_name}
+
+        if self.col.manufacturer == 'Lenovo':
+            # Lenovo has always Firmware: in front of the names, let's remove it
+            item_name = fw_item['Name'].replace('Firmware:','')
+            current_labels.update({"item_name": item_name})
+            # we need an additional label to distinguish the metrics because
+            # the device ID is not in the name in case of Lenovo
+            if "Id" in fw_item:
+                current_labels.update({"item_id": fw_item['Id']})
+
+        if "Manufacturer" in fw_item:
+            current_labels.update({"item_manufacturer": fw_item['Manufacturer']})
+
+        if "Version" in fw_item:
+            version = fw_item['Version']
+            if version != "N/A" and version != None:
+                current_labels.update({"version": version})
+                return current_labels
+
+        return None
+
+    def get_items_incremental(self, fw_members):
+        # only fetch the items which are new or changed since the last scrape
+        state = self.col.firmware_states.get(self.col.target)
+
+        def is_current(fw_member):
+            if not state or fw_member["@odata.id"] not in state.items:
+                return False
+            # only the ETag of the item in the collection tells it did not change, items without one are requested
+            # again, with If-None-Match through the response cache, so an unchanged item costs a 304 answer
+            return "@odata.etag" in fw_member and fw_member["@odata.etag"] == state.items[fw_member["@odata.id"]][0]
+
+        # unchanged items are taken from the state, changed items inlined by $expand are used as they are
+        refetch = {
+            fw_member["@odata.id"]: fw_member
+            for fw_member in fw_members
+            if not is_current(fw_member)
+        }
+        fetched = dict(zip(refetch, self.col.resolve_links(refetch.values())))
+        firmware_items.labels("fetched").inc(len(refetch))
+        firmware_items.labels("reused").inc(len(fw_members) - len(refetch))
+        logging.debug(f"Target {self.col.target}: Fetched {len(refetch)} of {len(fw_members)} firmware items.")
+
+        items = {}
+        for fw_member in fw_members:
+            url = fw_member["@odata.id"]
+            if url not in fetched:
+                items[url] = state.items[url]
+            elif fetched[url]:
+                items[url] = (fetched[url].get("@odata.etag", ""), self.get_item_labels(fetched[url]))
+            # items which could not be fetched are tried again with the next scrape
+
+        self.col.firmware_states.put(self.col.target, FirmwareState(items, state.synced if state else time.time()))
+
+        return [items[fw_member["@odata.id"]][1] for fw_member in fw_members if fw_member["@odata.id"] in items]
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_tb is not None:
@@ -3,14 +3,27 @@ from prometheus_client.core import GaugeMetricFamily
 import logging
 import math
 
+from tracing import traced
+
 class HealthCollector(object):
 
+    # phase, URL it needs, method and the data missing without the URL
+    PHASES = [
+        ("processors", "Processors", "get_proc_health", "Processors"),
+        ("storage", "Storage", "get_storage_health", "Storage"),
+        ("chassis", "Chassis", "get_chassis_health", "Chassis"),
+        ("power_supplies", "Power", "get_power_health", "PSU"),
+        ("thermal", "Thermal", "get_thermal_health", "thermal"),
+        ("memory", "Memory", "get_memory_health", "memory"),
+    ]
+
     def __enter__(self):
         return self
 
     def __init__(self, redfish_metrics_collector):
 
         self.col = redfish_metrics_collector
+        self.trace = self.col.trace
 
         self.health_metrics = GaugeMetricFamily(
             "redfish_health",
@@ -28,15 +41,17 @@ class HealthCollector(object):
             labels=self.col.labels,
         )
 
+    @traced("processors")
     def get_proc_health(self):
         logging.debug(f"Target {self.col.target}: Get the CPU health data.")
-        processor_collection = self.col.connect_server(self.col.urls["Processors"])
+        processor_collection = self.col.get_collection(self.col.urls["Processors"])
 
         if not processor_collection:
             return
-        for processor in processor_collection["Members"]:
-            processor_data = self.col.connect_server(processor["@odata.id"])
-            
+
+        processors = self.col.resolve_links(processor_collection["Members"])
+
+        for processor_data in processors:
             if not processor_data:
                 continue
 
@@ -62,14 +77,27 @@ class HealthCollector(object):
 
             self.health_metrics.add_sample("redfish_health", value=proc_status, labels=current_labels)
 
+    @traced("storage")
     def get_storage_health(self):
         logging.debug(f"Target {self.col.target}: Get the storage health data.")
-        storage_collection = self.col.connect_server(self.col.urls["Storage"])
+        # with $expand the disks come along with the controllers
+        storage_collection = self.col.get_collection(self.col.urls["Storage"], levels=2)
 
         if not storage_collection:
             return
-        for controller in storage_collection["Members"]:
-            controller_data = self.col.connect_server(controller["@odata.id"])
+
+        controllers = self.col.resolve_links(storage_collection["Members"])
+
+        # fetch the disks of all controllers at once
+        disk_links = [
+            disk
+            for controller_data in controllers
+            if controller_data
+            for disk in controller_data.get("Drives", [])
+        ]
+        disks = dict(zip((disk["@odata.id"] for disk in disk_links), self.col.resolve_links(disk_links)))
+
+        for controller_data in controllers:
             if not controller_data:
                 continue
             if controller_data.get("StorageControllers"):
@@ -127,7 +155,7 @@ class HealthCollector(object):
                 "SerialNumber": "serial_number",
             }
             for disk in controller_data["Drives"]:
-                disk_data = self.col.connect_server(disk["@odata.id"])
+                disk_data = disks[disk["@odata.id"]]
                 if disk_data == "":
                     continue
 
@@ -158,6 +186,7 @@ class HealthCollector(object):
                 else:
                     logging.warning(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}, Disk {disk_data['name']}: No health data found.")
 
+    @traced("chassis")
     def get_chassis_health(self):
         logging.debug(f"Target {self.col.target}: Get the Chassis health data.")
         chassis_data = self.col.connect_server(self.col.urls["Chassis"])
@@ -175,6 +204,7 @@ class HealthCollector(object):
             labels=current_labels,
         )
 
+    @traced("power_supplies")
     def get_power_health(self):
         logging.debug(f"Target {self.col.target}: Get the PDU health data.")
         power_data = self.col.connect_server(self.col.urls["Power"])
@@ -211,6 +241,7 @@ class HealthCollector(object):
                 "redfish_health", value=psu_health, labels=current_labels
             )
 
+    @traced("thermal")
     def get_thermal_health(self):
         logging.debug(f"Target {self.col.target}: Get the thermal health data.")
         thermal_data = self.col.connect_server(self.col.urls["Thermal"])
@@ -249,16 +280,19 @@ class HealthCollector(object):
                 "redfish_health", value=fan_health, labels=current_labels
             )
 
+    @traced("memory")
     def get_memory_health(self):
         logging.debug(f"Target {self.col.target}: Get the Memory data.")
 
-        memory_collection = self.col.connect_server(self.col.urls["Memory"])
+        # with $expand the dimm metrics come along with the dimms
+        memory_collection = self.col.get_collection(self.col.urls["Memory"], levels=2)
         if not memory_collection:
             return
 
-        for dimm_url in memory_collection["Members"]:
-            dimm_info = self.col.connect_server(dimm_url["@odata.id"])
+        dimms = self.col.resolve_links(memory_collection["Members"])
+        dimms_with_metrics = []
 
+        for dimm_info in dimms:
             if not dimm_info:
                 continue
 
@@ -306,81 +340,68 @@ class HealthCollector(object):
             )
 
             if "Metrics" in dimm_info:
-                dimm_metrics = self.col.connect_server(dimm_info["Metrics"]["@odata.id"])
-                if not dimm_metrics:
-                    continue
+                dimms_with_metrics.append((dimm_info, current_labels))
+            else:
+                logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No Dimm Metrics found.")
 
-                # Lenovo XCC SR650 v3 is missing the entries. Need to catch this.
-                if 'CorrectableECCError' in dimm_metrics["HealthData"]["AlarmTrips"]:
-                    correctable_ecc_error = (
-                        math.nan
-                        if dimm_metrics["HealthData"]["AlarmTrips"]["CorrectableECCError"]
-                        is None
-                        else int(dimm_metrics["HealthData"]["AlarmTrips"]["CorrectableECCError"])
-                    )
-                    self.mem_metrics_correctable.add_sample("redfish_memory_correctable", value=correctable_ecc_error, labels=current_labels)
-                else:
-                    logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No CorrectableECCError Metrics found.")
+        # fetch the error counters of all dimms at once
+        all_dimm_metrics = self.col.resolve_links(dimm_info["Metrics"] for dimm_info, _ in dimms_with_metrics)
 
-                if 'UncorrectableECCError' in dimm_metrics["HealthData"]["AlarmTrips"]:
-                    uncorrectable_ecc_error = (
-                        math.nan
-                        if dimm_metrics["HealthData"]["AlarmTrips"]["UncorrectableECCError"]
-                        is None
-                        else int(dimm_metrics["HealthData"]["AlarmTrips"]["UncorrectableECCError"])
-                    )
-                    self.mem_metrics_unorrectable.add_sample("redfish_memory_uncorrectable", value=uncorrectable_ecc_error, labels=current_labels)
-                else:
-                    logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No UncorrectableECCError Metrics found.")
+        for (dimm_info, current_labels), dimm_metrics in zip(dimms_with_metrics, all_dimm_metrics):
+            if not dimm_metrics:
+                continue
 
+            # Lenovo XCC SR650 v3 is missing the entries. Need to catch this.
+            if 'CorrectableECCError' in dimm_metrics["HealthData"]["AlarmTrips"]:
+                correctable_ecc_error = (
+                    math.nan
+                    if dimm_metrics["HealthData"]["AlarmTrips"]["CorrectableECCError"]
+                    is None
+                    else int(dimm_metrics["HealthData"]["AlarmTrips"]["CorrectableECCError"])
+                )
+                self.mem_metrics_correctable.add_sample("redfish_memory_correctable", value=correctable_ecc_error, labels=current_labels)
             else:
-                logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No Dimm Metrics found.")
+                logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No CorrectableECCError Metrics found.")
 
-    def collect(self):
+            if 'UncorrectableECCError' in dimm_metrics["HealthData"]["AlarmTrips"]:
+                uncorrectable_ecc_error = (
+                    math.nan
+                    if dimm_metrics["HealthData"]["AlarmTrips"]["UncorrectableECCError"]
+                    is None
+                    else int(dimm_metrics["HealthData"]["AlarmTrips"]["UncorrectableECCError"])
+                )
+                self.mem_metrics_unorrectable.add_sample("redfish_memory_uncorrectable", value=uncorrectable_ecc_error, labels=current_labels)
+            else:
+                logging.debug(f"Target {self.col.target}: Host {self.col.host}, Model {self.col.model}: Dimm {dimm_info['Name']}: No UncorrectableECCError Metrics found.")
+
+    def collect(self, phases=None):
 
         logging.info(f"Target {self.col.target}: Collecting data ...")
 
-        current_labels = {"device_type": "system", "device_name": "summary"}
-        current_labels.update(self.col.labels)
-        self.health_metrics.add_sample(
-            "redfish_health", value=self.col.server_health, labels=current_labels
-        )
+        if phases is None:
+            current_labels = {"device_type": "system", "device_name": "summary"}
+            current_labels.update(self.col.labels)
+            self.health_metrics.add_sample(
+                "redfish_health", value=self.col.server_health, labels=current_labels
+            )
+
+        # the phases run at the same time, each with its own collector whose samples are added in the order of the phases
+        buffers = []
+        for phase, url, method, data in self.PHASES:
+            if phases is not None and phase not in phases:
+                continue
+
+            if self.col.urls[url]:
+                buffers.append((HealthCollector(self.col), method))
+            else:
+                logging.warning(f"Target {self.col.target}: No {url} URL provided! Cannot get {data} data!")
+
+        self.col.run_all(getattr(buffer, method) for buffer, method in buffers)
 
-        # Get the processor health data
-        if self.col.urls["Processors"]:
-            self.get_proc_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Processors URL provided! Cannot get Processors data!")
-
-        # Get the storage health data
-        if self.col.urls["Storage"]:
-            self.get_storage_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Storage URL provided! Cannot get Storage data!")
-
-        # Get the chassis health data
-        if self.col.urls["Chassis"]:
-            self.get_chassis_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Chassis URL provided! Cannot get Chassis data!")
-
-        # Get the powersupply health data
-        if self.col.urls["Power"]:
-            self.get_power_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Power URL provided! Cannot get PSU data!")
-
-        # Get the thermal health data
-        if self.col.urls["Thermal"]:
-            self.get_thermal_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Thermal URL provided! Cannot get thermal data!")
-
-        # Export the memory data
-        if self.col.urls["Memory"]:
-            self.get_memory_health()
-        else:
-            logging.warning(f"Target {self.col.target}: No Memory URL provided! Cannot get memory data!")
+        for buffer, method in buffers:
+            self.health_metrics.samples.extend(buffer.health_metrics.samples)
+            self.mem_metrics_correctable.samples.extend(buffer.mem_metrics_correctable.samples)
+            self.mem_metrics_unorrectable.samples.extend(buffer.mem_metrics_unorrectable.samples)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_tb is not None:
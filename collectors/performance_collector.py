@@ -3,6 +3,8 @@ from prometheus_client.core import GaugeMetricFamily
 import logging
 import math
 
+from tracing import traced
+
 class PerformanceCollector(object):
 
     def __enter__(self):
@@ -11,6 +13,7 @@ class PerformanceCollector(object):
     def __init__(self, redfish_metrics_collector):
 
         self.col = redfish_metrics_collector
+        self.trace = self.col.trace
 
         self.performance_metrics = GaugeMetricFamily(
             "redfish_performance",
@@ -29,6 +32,7 @@ class PerformanceCollector(object):
             unit="Celsius"
         )
 
+    @traced("power")
     def get_power_metrics(self):
         logging.debug(f"Target {self.col.target}: Get the PDU Power data.")
 
@@ -64,21 +68,20 @@ class PerformanceCollector(object):
                         )
 
             power_supplies_url = power_subsystem['PowerSupplies']['@odata.id']
-            power_supplies = self.col.connect_server(power_supplies_url)['Members']
+            # with $expand the power supply metrics come along with the power supplies
+            power_supplies = self.col.resolve_links(self.col.get_collection(power_supplies_url, levels=2)['Members'])
+            all_power_supply_metrics = self.col.resolve_links(power_supply['Metrics'] for power_supply in power_supplies)
 
             fields = ['Name', 'Model', 'SerialNumber', 'Id']
             metrics = ['InputVoltage', 'InputCurrentAmps', 'InputPowerWatts', 'OutputPowerWatts']
 
-            for power_supply in power_supplies:
+            for power_supply_data, power_supply_metrics in zip(power_supplies, all_power_supply_metrics):
                 power_supply_labels = {}
-                power_supply_data = self.col.connect_server(power_supply['@odata.id'])
                 for field in fields:
                     power_supply_labels.update({field: power_supply_data.get(field, 'unknown')})
 
                 power_supply_labels.update(self.col.labels)
 
-                power_supply_metrics_url = power_supply_data['Metrics']['@odata.id']
-                power_supply_metrics = self.col.connect_server(power_supply_metrics_url)
                 for metric in metrics:
                     current_labels = {'type': metric}
                     current_labels.update(power_supply_labels)
@@ -119,6 +122,7 @@ class PerformanceCollector(object):
             logging.warning(f"Target {self.col.target}, Host {self.col.host}, Model {self.col.model}: No power url found.")
 
 
+    @traced("temperature")
     def get_temp_metrics(self):
         logging.debug(f"Target {self.col.target}: Get the Thermal data.")
 
@@ -0,0 +1,62 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import json
+
+# fields of the Redfish resources the collectors read, all others are dropped by project()
+FIELDS = frozenset([
+    "@odata.id", "@odata.etag", "RedfishVersion", "Systems", "SessionService", "Sessions",
+    "Members", "Links", "Id", "Name", "Manufacturer", "Model", "SKU", "SerialNumber", "PowerState",
+    "Chassis", "ManagedBy", "Memory", "Processors", "Storage", "Power", "Thermal",
+    "PowerSubsystem", "ThermalSubsystem", "NetworkInterfaces",
+    "Socket", "ProcessorType", "TotalCores", "TotalThreads",
+    "Drives", "StorageControllers", "MediaType", "CapacityBytes", "Protocol", "PredictedMediaLifeLeftPercent",
+    "PowerSupplies", "Fans", "CapacityWatts", "Reading",
+    "InputVoltage", "InputCurrentAmps", "InputPowerWatts", "OutputPowerWatts",
+    "PowerOutputWatts", "EfficiencyPercent", "PowerInputWatts", "LineInputVoltage", "ThermalMetrics",
+    "CapacityMiB", "OperatingSpeedMhz", "MemoryDeviceType", "Oem", "Hpe", "VendorName",
+    "Metrics", "HealthData", "AlarmTrips", "CorrectableECCError", "UncorrectableECCError",
+    "Version",
+])
+
+# fields kept with everything below them, the collectors go through all of their keys
+SUBTREES = frozenset([
+    "Status", "ProtocolFeaturesSupported", "Allocation", "TemperatureSummaryCelsius",
+])
+
+
+def loads(data):
+    """Decodes a JSON document, with orjson if it is installed."""
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. UTF-16 or a byte order mark, which only the json module detects
+            pass
+
+    return json.loads(data)
+
+
+def dumps(document):
+    """Encodes a document as JSON bytes, with orjson if it is installed."""
+    if orjson:
+        return orjson.dumps(document)
+
+    return json.dumps(document).encode()
+
+
+def project(document):
+    """Returns the document with only the fields the collectors read."""
+    if isinstance(document, dict):
+        return {
+            key: value if key in SUBTREES else project(value)
+            for key, value in document.items()
+            if key in FIELDS or key in SUBTREES
+        }
+
+    if isinstance(document, list):
+        return [project(item) for item in document]
+
+    return document
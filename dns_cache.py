@@ -0,0 +1,131 @@
+from prometheus_client import Counter, Histogram
+
+from collections import OrderedDict
+
+import logging
+import threading
+import time
+
+dns_requests = Counter(
+    "redfish_exporter_dns_cache_requests",
+    "Lookups in the DNS cache by result (hit, negative_hit or miss)",
+    ["result"],
+)
+dns_lookup_duration = Histogram(
+    "redfish_exporter_dns_lookup_duration_seconds",
+    "Duration of the DNS lookups sent to the resolver",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+class _Entry(object):
+    """Result of a lookup, either a value or the error the resolver raised."""
+
+    def __init__(self, value, error, expires):
+        self.value = value
+        self.error = error
+        self.expires = expires
+
+
+class DnsCache(object):
+    """Caches forward and reverse lookups, failed lookups are cached for a shorter time."""
+
+    def __init__(self, ttl, negative_ttl, max_entries):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, function, name):
+        # returns function(name) from the cache, e.g. socket.gethostbyname
+        key = (function.__name__, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+
+        now = time.time()
+        if not entry or entry.expires <= now:
+            dns_requests.labels("miss").inc()
+            entry = self._resolve(key, function, name)
+
+        elif entry.error:
+            dns_requests.labels("negative_hit").inc()
+
+        else:
+            dns_requests.labels("hit").inc()
+
+            # refresh entries in the last fifth of their lifetime so the scrapes don't wait for the resolver
+            if entry.expires - now < self.ttl / 5:
+                self._refresh(key, function, name)
+
+        if entry.error:
+            raise entry.error
+
+        return entry.value
+
+    def _resolve(self, key, function, name):
+        start = time.time()
+        try:
+            entry = _Entry(function(name), None, 0)
+            entry.expires = time.time() + self.ttl
+
+        except OSError as err:
+            entry = _Entry(None, err, time.time() + self.negative_ttl)
+
+        finally:
+            dns_lookup_duration.observe(time.time() - start)
+
+        with self._lock:
+            # a failed refresh keeps the old answer until it expires, only lookups without one are cached as failed
+            old = self._entries.get(key)
+            if entry.error and old and not old.error and old.expires > time.time():
+                return entry
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return entry
+
+    def _refresh(self, key, function, name):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                entry = self._resolve(key, function, name)
+                if entry.error:
+                    logging.warning(f"Target {name}: Refreshing the DNS cache failed, keeping the last answer until it expires: {entry.error}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name="dns-refresh", daemon=True).start()
+
+
+def get_dns_cache(config):
+    # one cache for all lookups, None if it is switched off
+    global _cache
+
+    dns_config = config.get("dns_cache", {})
+    ttl = int(dns_config.get("ttl", 300))
+    if not ttl:
+        return None
+
+    with _cache_lock:
+        if not _cache:
+            _cache = DnsCache(
+                ttl = ttl,
+                negative_ttl = int(dns_config.get("negative_ttl", 30)),
+                max_entries = int(dns_config.get("max_entries", 10000)),
+            )
+
+        return _cache
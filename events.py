@@ -0,0 +1,222 @@
+from prometheus_client import Counter, Gauge
+
+import logging
+import os
+import requests
+import threading
+
+import decoder
+from handler import resolve_target, get_credentials
+from response_cache import resource_class
+
+events_received = Counter(
+    "redfish_exporter_events_received",
+    "Events received from the Redfish event streams by the health phase they refresh",
+    ["phase"],
+)
+event_streams = Gauge(
+    "redfish_exporter_event_streams",
+    "Number of Redfish event streams the exporter is currently connected to",
+)
+
+# resource classes of the origins of the events and the health phases showing them
+PHASES = {
+    "Processors": "processors",
+    "Storage": "storage",
+    "StorageControllers": "storage",
+    "Drives": "storage",
+    "Volumes": "storage",
+    "Chassis": "chassis",
+    "Power": "power_supplies",
+    "PowerSubsystem": "power_supplies",
+    "PowerSupplies": "power_supplies",
+    "Thermal": "thermal",
+    "ThermalSubsystem": "thermal",
+    "ThermalMetrics": "thermal",
+    "Memory": "memory",
+    "MemoryMetrics": "memory",
+}
+
+# resource classes of origins which are not part of the health data, e.g. the SEL entries of a system logged with
+# every event, and origins outside of the systems and chassis like tasks or jobs
+IGNORED = {
+    "Managers", "SessionService", "EventService", "UpdateService", "FirmwareInventory", "NetworkInterfaces",
+    "LogServices", "Other",
+}
+
+# device types of the samples of redfish_health written by the phases
+DEVICE_TYPES = {
+    "processors": {"processor"},
+    "storage": {"storage", "disk"},
+    "chassis": {"chassis"},
+    "power_supplies": {"powersupply"},
+    "thermal": {"fan"},
+    "memory": {"memory"},
+}
+
+def event_phases(document):
+    """Returns the health phases affected by the events of an event document, "full" if all of them are."""
+    phases = set()
+    for event in document.get("Events", []):
+        if "Heartbeat" in event.get("MessageId", ""):
+            continue
+
+        origin = event.get("OriginOfCondition")
+        if isinstance(origin, dict):
+            origin = origin.get("@odata.id")
+
+        if origin and resource_class(origin) in IGNORED:
+            continue
+
+        # events without origin or on another part of the system need the whole health data
+        phases.add(PHASES.get(resource_class(origin), "full") if origin else "full")
+
+    return phases
+
+
+def replace_phase_samples(families, new_families, phases):
+    """Replaces the samples of the phases in the health metric families with the ones read again."""
+    device_types = set()
+    for phase in phases:
+        device_types |= DEVICE_TYPES[phase]
+
+    new_samples = {family.name: family.samples for family in new_families}
+
+    for family in families:
+        if family.name not in new_samples:
+            continue
+
+        # the new samples take the place of the old ones
+        samples = []
+        inserted = False
+        for sample in family.samples:
+            if sample.labels.get("device_type") in device_types:
+                if not inserted:
+                    samples.extend(new_samples[family.name])
+                    inserted = True
+                continue
+            samples.append(sample)
+
+        if not inserted:
+            samples.extend(new_samples[family.name])
+
+        family.samples = samples
+
+
+class EventsNotSupported(Exception):
+    """The server has no EventService with server sent events."""
+    pass
+
+
+class EventListener(object):
+    """Follows the server sent events of one server and hands the affected health phases to a callback."""
+
+    def __init__(self, config, target, job, callback, dns_cache=None):
+        self.target = target
+        self.job = job
+
+        events = config.get("polling", {}).get("events", {})
+        self._config = config
+        self._callback = callback
+        self._dns_cache = dns_cache
+        self._timeout = int(os.getenv("TIMEOUT", config.get('timeout', 10)))
+        self._idle_timeout = int(events.get("idle_timeout", 600))
+        self._reconnect_interval = int(events.get("reconnect_interval", 60))
+        self._connected = False
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"events-{self.target}", daemon=True).start()
+
+    def stop(self):
+        # a stream waiting for data ends with the next event or the idle timeout
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+
+            except EventsNotSupported as err:
+                logging.warning(f"Target {self.target}: Not listening to events: {err}")
+                return
+
+            except Exception as err:
+                if not self._stop.is_set():
+                    logging.warning(f"Target {self.target}: Event stream failed: {err}")
+
+            # events may have been missed while the stream was down, so the health data is read again completely
+            if self._connected and not self._stop.is_set():
+                self._connected = False
+                self._callback(self.target, self.job, {"full"})
+
+            self._stop.wait(self._reconnect_interval)
+
+    def _get(self, url, auth=None, **kwargs):
+        response = requests.get(url, auth=auth, verify=False, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _listen(self):
+        target_ip, host = resolve_target(self.target, self._dns_cache)
+        usr, pwd = get_credentials(self._config, self.job, self.target)
+        base_url = f"https://{target_ip}"
+
+        service_root = decoder.loads(self._get(f"{base_url}/redfish/v1", timeout=self._timeout).content)
+        if "EventService" not in service_root:
+            raise EventsNotSupported("No EventService on the server")
+
+        event_service = decoder.loads(self._get(
+            f"{base_url}{service_root['EventService']['@odata.id']}", auth=(usr, pwd), timeout=self._timeout
+        ).content)
+        if not event_service.get("ServiceEnabled", True) or "ServerSentEventUri" not in event_service:
+            raise EventsNotSupported("The EventService does not support server sent events")
+
+        response = self._get(
+            f"{base_url}{event_service['ServerSentEventUri']}",
+            auth = (usr, pwd),
+            stream = True,
+            headers = {"Accept": "text/event-stream"},
+            timeout = (self._timeout, self._idle_timeout),
+        )
+        logging.info(f"Target {self.target}: Listening to the events of server {host}")
+
+        self._connected = True
+        event_streams.inc()
+        try:
+            # read byte by byte, larger chunks wait for more data before an event is handed out
+            data = []
+            for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                if self._stop.is_set():
+                    break
+
+                if line.startswith("data:"):
+                    data.append(line[5:].strip())
+
+                elif not line and data:
+                    # an empty line ends the event
+                    self._dispatch("\n".join(data))
+                    data = []
+
+        finally:
+            event_streams.dec()
+            response.close()
+
+        raise RuntimeError("The server closed the event stream")
+
+    def _dispatch(self, data):
+        try:
+            document = decoder.loads(data)
+        except ValueError:
+            logging.debug(f"Target {self.target}: No json data in event: {data}")
+            return
+
+        phases = event_phases(document)
+        if not phases:
+            return
+
+        for phase in phases:
+            events_received.labels(phase).inc()
+
+        logging.debug(f"Target {self.target}: Event affects the health phases {', '.join(sorted(phases))}")
+        self._callback(self.target, self.job, phases)
@@ -0,0 +1,88 @@
+from prometheus_client import Counter
+
+import threading
+import time
+
+from persistent_store import get_persistent_store
+
+firmware_items = Counter(
+    "redfish_exporter_firmware_inventory_items",
+    "Firmware inventory items of the scrapes by result (fetched or reused from an earlier scrape)",
+    ["result"],
+)
+
+_store = None
+_store_lock = threading.Lock()
+
+class FirmwareState(object):
+    """Firmware inventory of a server with the ETags it was read with."""
+
+    def __init__(self, items, synced):
+        # URL of the item -> (ETag of the item, labels of its sample or None)
+        self.items = items
+        self.synced = synced
+
+
+class FirmwareStateStore(object):
+    """Firmware inventories of the last scrapes by target, they are read again completely after resync_interval."""
+
+    def __init__(self, resync_interval, store=None):
+        self.resync_interval = resync_interval
+        self._states = {}
+        self._lock = threading.Lock()
+        self._store = store
+        self._loaded = set()
+
+    def get(self, target):
+        # None if the target was not scraped yet or a full resync is due
+        if not self.loaded(target):
+            self.load(target)
+
+        with self._lock:
+            state = self._states.get(target)
+
+        if state and time.time() - state.synced < self.resync_interval:
+            return state
+
+        return None
+
+    def put(self, target, state):
+        now = time.time()
+        with self._lock:
+            self._states[target] = state
+
+            # forget servers that are no longer scraped
+            for expired in [key for key, value in self._states.items() if now - value.synced >= self.resync_interval]:
+                del self._states[expired]
+
+        if self._store:
+            self._store.put_firmware(target, state)
+
+    def loaded(self, target):
+        return not self._store or target in self._loaded
+
+    def load(self, target):
+        # the inventory of a target from before a restart is read with its first scrape
+        with self._lock:
+            if target in self._loaded:
+                return
+            self._loaded.add(target)
+
+        stored = self._store.load_firmware(target)
+        if stored:
+            with self._lock:
+                self._states.setdefault(target, FirmwareState(*stored))
+
+
+def get_firmware_state_store(config):
+    # one store for all scrapes, None if the incremental firmware collection is switched off
+    global _store
+
+    if not config.get("firmware_incremental", False):
+        return None
+
+    with _store_lock:
+        if not _store:
+            _store = FirmwareStateStore(int(config.get("firmware_resync_interval", 3600)), get_persistent_store(config))
+
+        return _store
@@ -7,10 +7,20 @@ import json
 import sys
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
 from prometheus_client.exposition import CONTENT_TYPE_LATEST
 from prometheus_client.exposition import generate_latest
 
+from cluster import get_cluster
 from collector import RedfishMetricsCollector
+from dns_cache import get_dns_cache
+from singleflight import SingleFlight, coalesced_requests
+from tracing import get_trace_store
+
+METRICS_TYPES = ["health", "firmware", "performance"]
 
 class welcomePage:
     def on_get(self, req, resp):
@@ -23,16 +33,232 @@ class welcomePage:
             <li>Use <a href="/health">/health</a> to retrieve health metrics.</li>
             <li>Use <a href="/firmware">/firmware</a> to retrieve firmware version metrics.</li>
             <li>Use <a href="/performance">/performance</a> to retrieve performance metrics.</li>
+            <li>Use <a href="/all">/all</a> to retrieve all of them in one scrape, /all?modules=health,performance for some of them.</li>
+            <li>Use /batch?group=&lt;group&gt;&amp;type=&lt;type&gt; to retrieve the metrics of many servers at once.</li>
+            <li>Use <a href="/metrics">/metrics</a> to retrieve the metrics of the exporter itself.</li>
+            <li>Use <a href="/traces">/traces</a> to see the phases of the slowest recent scrapes, if trace_history is set.</li>
+            <li>Use <a href="/targets">/targets</a> to discover the targets of this replica, if cluster is set.</li>
         </ul>
         """
 
 
+class StaticCollector(object):
+    """Registry stand-in to render a fixed list of metric families."""
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def collect(self):
+        return self._metrics
+
+
+class StreamedBody(object):
+    """Body of a streamed response, calls finish when it is closed also if the server never read it."""
+
+    def __init__(self, chunks, finish):
+        self._chunks = chunks
+        self._finish = finish
+
+    def __iter__(self):
+        return self._chunks
+
+    def close(self):
+        # called by the WSGI server after the response, also when the client went away before the first byte
+        self._chunks.close()
+        self._finish()
+
+
+class exporterMetricsHandler:
+    def on_get(self, req, resp):
+        resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        resp.text = generate_latest(REGISTRY)
+        resp.status = falcon.HTTP_200
+
+
+class tracesHandler:
+    def __init__(self, config):
+        self._store = get_trace_store(config)
+
+    def on_get(self, req, resp):
+        limit = req.get_param_as_int("limit", min_value=1) or 10
+        target = req.get_param("target")
+        metrics_type = req.get_param("type")
+
+        traces = self._store.slowest(limit, target=target, metrics_type=metrics_type)
+
+        resp.content_type = falcon.MEDIA_JSON
+        resp.text = json.dumps([trace.to_dict() for trace in traces], indent=2)
+        resp.status = falcon.HTTP_200
+
+
+class targetsHandler:
+    """Prometheus HTTP service discovery of the targets the hash ring assigns to this replica."""
+
+    def __init__(self, config):
+        self._cluster = get_cluster(config)
+
+    def on_get(self, req, resp):
+        # one target group per job and label set, the replica is passed on for the relabeling of __address__
+        groups = {}
+        for target, job, labels in self._cluster.shard():
+            key = (job, tuple(sorted(labels.items())))
+            if key not in groups:
+                group_labels = dict(labels, __meta_redfish_exporter_replica=self._cluster.replica)
+                # without a job the exporter takes the one of the config file
+                if job is not None:
+                    group_labels["__param_job"] = str(job)
+                groups[key] = {"targets": [], "labels": group_labels}
+            groups[key]["targets"].append(target)
+
+        resp.content_type = falcon.MEDIA_JSON
+        resp.text = json.dumps(list(groups.values()), indent=2)
+        resp.status = falcon.HTTP_200
+
+
+def _lookup(function, name, dns_cache):
+    if dns_cache:
+        return dns_cache.lookup(function, name)
+
+    return function(name)
+
+
+def resolve_target(target, dns_cache=None):
+    """Returns the IP address and the hostname of a target."""
+    ip_re = re.compile(
+        r"^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$"
+    )
+
+    if ip_re.match(target):
+        logging.debug(f"Target {target}: Target is an IP Address.")
+        try:
+            lookup_result = _lookup(socket.gethostbyaddr, target, dns_cache)[0]
+            if lookup_result:
+                host = lookup_result
+        except socket.herror as err:
+            msg = f"Target {target}: Reverse DNS lookup failed: {err}"
+            logging.error(msg)
+            raise falcon.HTTPInvalidParam(msg, "target")
+    else:
+        logging.debug(f"Target {target}: Target is a hostname.")
+        host = target
+        try:
+            lookup_result = _lookup(socket.gethostbyname, host, dns_cache)
+            if lookup_result:
+                target = lookup_result
+        except socket.gaierror as err:
+            msg = f"Target {target}: DNS lookup failed: {err}"
+            logging.error(msg)
+            raise falcon.HTTPInvalidParam(msg, "target")
+
+    return target, host
+
+
+def get_credentials(config, job, target):
+    """Returns user and password for a job from the environment or the config file."""
+    usr_env_var = job.replace("-", "_").upper() + "_USERNAME"
+    pwd_env_var = job.replace("-", "_").upper() + "_PASSWORD"
+    usr = os.getenv(usr_env_var, config.get("username"))
+    pwd = os.getenv(pwd_env_var, config.get("password"))
+
+    if not usr or not pwd:
+        msg = f"Target {target}: Unknown job provided or no user/password found in environment and config file: {job}"
+        logging.error(msg)
+        raise falcon.HTTPInvalidParam(msg, "job")
+
+    logging.debug(f"Target {target}: Using user {usr}")
+    return usr, pwd
+
+
+def collect_metrics(config, target, host, usr, pwd, metrics_type, session_pool=None, modules=None):
+    """Scrapes one server and returns the metrics in the Prometheus text format."""
+    with RedfishMetricsCollector(
+        config,
+        target = target,
+        host = host,
+        usr = usr,
+        pwd = pwd,
+        metrics_type = metrics_type,
+        session_pool = session_pool,
+        modules = modules
+    ) as registry:
+
+        # open a session with the remote board
+        registry.get_session()
+
+        # collect the actual metrics
+        return generate_latest(registry)
+
+
+def collect_metric_families(config, target, host, usr, pwd, metrics_type, session_pool=None):
+    """Scrapes one server and returns its metric families, including redfish_up for every metrics type."""
+    with RedfishMetricsCollector(
+        config,
+        target = target,
+        host = host,
+        usr = usr,
+        pwd = pwd,
+        metrics_type = metrics_type,
+        session_pool = session_pool
+    ) as registry:
+
+        # open a session with the remote board
+        registry.get_session()
+
+        # the families have to be collected before the session is closed
+        return list(registry.collect_batch())
+
+
+def collect_health_phases(config, target, host, usr, pwd, phases, session_pool=None):
+    """Scrapes some phases of the health data of one server, returns the metric families or None if it is down."""
+    with RedfishMetricsCollector(
+        config,
+        target = target,
+        host = host,
+        usr = usr,
+        pwd = pwd,
+        metrics_type = 'health',
+        session_pool = session_pool
+    ) as registry:
+
+        registry.get_session()
+        return registry.collect_health_phases(phases)
+
+
+def down_metrics(host):
+    """Returns redfish_up for a server that could not be scraped at all."""
+    up_metrics = GaugeMetricFamily(
+        "redfish_up",
+        "Redfish Server Monitoring availability",
+        labels = {"host": host},
+    )
+    up_metrics.add_sample("redfish_up", value = 0, labels = {"host": host})
+    return [up_metrics]
+
+
+def merge_metric_families(results):
+    """Combines the metric families of several servers, each metric name must only appear once in the output."""
+    merged = {}
+    for metrics in results:
+        for metric in metrics:
+            if metric.name in merged:
+                merged[metric.name].samples.extend(metric.samples)
+            else:
+                merged[metric.name] = metric
+
+    return list(merged.values())
+
+
 class metricsHandler:
-    def __init__(self, config, metrics_type):
+    def __init__(self, config, metrics_type, session_pool=None, poller=None):
         self._config = config
         self.metrics_type = metrics_type
+        self._session_pool = session_pool
+        self._poller = poller
+        self._dns_cache = get_dns_cache(config)
+        self._streaming = bool(config.get("streaming", False))
+        self._single_flight = SingleFlight()
 
-    def on_get(self, req, resp):
+    def _get_params(self, req):
         target = req.get_param("target")
         if not target:
             logging.error("No target parameter provided!")
@@ -40,71 +266,234 @@ class metricsHandler:
 
         logging.debug(f"Received Target: {target}")
 
-        self._job = req.get_param("job")
-        if not self._job:
+        job = req.get_param("job")
+        if not job:
             logging.error(f"Target {target}: No job provided!")
             raise falcon.HTTPMissingParam("job")
 
-        logging.debug(f"Received Job: {self._job}")
+        logging.debug(f"Received Job: {job}")
+        return target, job
 
-        ip_re = re.compile(
-            r"^(([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])\.){3}([0-9]|[1-9][0-9]|1[0-9]{2}|2[0-4][0-9]|25[0-5])$"
-        )
+    def _get_modules(self, req):
+        # the metrics types of the combined scrape, all of them if no modules are given
+        if self.metrics_type != 'all':
+            return None
+
+        modules = [
+            module for value in req.get_param_as_list("modules", default=[])
+            for module in value.split(",") if module
+        ]
+        for module in modules:
+            if module not in METRICS_TYPES:
+                logging.error(f"Unknown module provided: {module}")
+                raise falcon.HTTPInvalidParam(f"Must be one of {', '.join(METRICS_TYPES)}", "modules")
+
+        return tuple(module for module in METRICS_TYPES if module in modules or not modules)
+
+    def on_get(self, req, resp):
+        target, job = self._get_params(req)
+        modules = self._get_modules(req)
 
         resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
 
-        if ip_re.match(target):
-            logging.debug(f"Target {target}: Target is an IP Address.")
+        # targets polled in the background are answered from memory
+        if self._poller and not modules:
+            output = self._poller.get_metrics(target, job, self.metrics_type)
+            if output:
+                logging.debug(f"Target {target}: Serving polled {self.metrics_type} metrics.")
+                resp.text = output
+                resp.status = falcon.HTTP_200
+                return
+
+        if self._streaming:
+            self._stream(target, job, resp, modules)
+            return
+
+        # identical scrapes arriving at the same time share one scrape of the server
+        try:
+            output, shared = self._single_flight.do(
+                (target, self.metrics_type, job, modules),
+                lambda: self._scrape(target, job, modules)
+            )
+        except TimeoutError as err:
+            logging.error(f"Target {target}: {err}")
+            raise falcon.HTTPGatewayTimeout(title="Gateway Timeout", description=str(err))
+        if shared:
+            logging.debug(f"Target {target}: Answered with the result of a running {self.metrics_type} scrape.")
+            coalesced_requests.labels(self.metrics_type).inc()
+
+        resp.text = output
+        resp.status = falcon.HTTP_200
+
+    def _stream(self, target, job, resp, modules=None):
+        key = (target, self.metrics_type, job, modules)
+        call, leader = self._single_flight.begin(key)
+
+        if not leader:
+            logging.debug(f"Target {target}: Answered with the result of a running {self.metrics_type} scrape.")
+            coalesced_requests.labels(self.metrics_type).inc()
             try:
-                lookup_result = socket.gethostbyaddr(target)[0]
-                if lookup_result:
-                    host = lookup_result
-            except socket.herror as err:
-                msg = f"Target {target}: Reverse DNS lookup failed: {err}"
-                logging.error(msg)
-                raise falcon.HTTPInvalidParam(msg, "target")
+                resp.text = self._single_flight.wait(call)
+            except TimeoutError as err:
+                logging.error(f"Target {target}: {err}")
+                raise falcon.HTTPGatewayTimeout(title="Gateway Timeout", description=str(err))
+            resp.status = falcon.HTTP_200
+            return
+
+        # errors before the first byte are still answered with an error status
+        try:
+            target, host = resolve_target(target, self._dns_cache)
+            usr, pwd = get_credentials(self._config, job, target)
+        except Exception as err:
+            self._single_flight.finish(key, call, error=err)
+            raise
+
+        # a body that is never read does not run the finally of the generator, closing it still frees the key
+        aborted = falcon.HTTPBadRequest(title="Bad Request", description="Scrape was aborted")
+        resp.stream = StreamedBody(
+            self._stream_metrics(key, call, target, host, usr, pwd, modules),
+            lambda: call.done.is_set() or self._single_flight.finish(key, call, error=aborted),
+        )
+        resp.status = falcon.HTTP_200
+
+    def _stream_metrics(self, key, call, target, host, usr, pwd, modules=None):
+        # every metric family is sent as soon as it is collected, the followers get the whole text at the end
+        chunks = []
+        error = falcon.HTTPBadRequest(title="Bad Request", description="Scrape was aborted")
+
+        try:
+            with RedfishMetricsCollector(
+                self._config,
+                target = target,
+                host = host,
+                usr = usr,
+                pwd = pwd,
+                metrics_type = self.metrics_type,
+                session_pool = self._session_pool,
+                modules = modules
+            ) as registry:
+
+                # open a session with the remote board
+                registry.get_session()
+
+                for metric in registry.collect():
+                    chunk = generate_latest(StaticCollector([metric]))
+                    chunks.append(chunk)
+                    yield chunk
+
+            error = None
+
+        except Exception:
+            # the status is already sent, the scrape fails with the broken connection
+            message = f"Exception: {traceback.format_exc()}"
+            logging.error(f"Target {target}: {message}")
+            error = falcon.HTTPBadRequest(title="Bad Request", description=message)
+            raise
+
+        finally:
+            self._single_flight.finish(key, call, result=b"".join(chunks), error=error)
+
+    def _scrape(self, target, job, modules=None):
+        target, host = resolve_target(target, self._dns_cache)
+        usr, pwd = get_credentials(self._config, job, target)
+
+        try:
+            return collect_metrics(
+                self._config,
+                target = target,
+                host = host,
+                usr = usr,
+                pwd = pwd,
+                metrics_type = self.metrics_type,
+                session_pool = self._session_pool,
+                modules = modules
+            )
+
+        except Exception as err:
+            message = f"Exception: {traceback.format_exc()}"
+            logging.error(f"Target {target}: {message}")
+            raise falcon.HTTPBadRequest("Bad Request", message)
+
+
+class batchHandler:
+    def __init__(self, config, session_pool=None):
+        self._config = config
+        self._session_pool = session_pool
+        self._dns_cache = get_dns_cache(config)
+
+        # one pool for all batch calls limits the scrapes running at the same time
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(config.get("batch_concurrency", 32)), thread_name_prefix="batch"
+        )
+
+    def _get_params(self, req):
+        metrics_type = req.get_param("type", default="health")
+        if metrics_type not in METRICS_TYPES:
+            logging.error(f"Unknown metrics type provided: {metrics_type}")
+            raise falcon.HTTPInvalidParam(f"Must be one of {', '.join(METRICS_TYPES)}", "type")
+
+        job = req.get_param("job")
+        group = req.get_param("group")
+
+        if group:
+            group_config = self._config.get("groups", {}).get(group)
+            if not group_config:
+                logging.error(f"Unknown group provided: {group}")
+                raise falcon.HTTPInvalidParam("Group not found in config file", "group")
+
+            targets = group_config.get("targets", [])
+            job = job or group_config.get("job", self._config.get("job"))
+
         else:
-            logging.debug(f"Target {target}: Target is a hostname.")
-            host = target
-            try:
-                lookup_result = socket.gethostbyname(host)
-                if lookup_result:
-                    target = lookup_result
-            except socket.gaierror as err:
-                msg = f"Target {target}: DNS lookup failed: {err}"
-                logging.error(msg)
-                raise falcon.HTTPInvalidParam(msg, "target")
-
-        usr_env_var = self._job.replace("-", "_").upper() + "_USERNAME"
-        pwd_env_var = self._job.replace("-", "_").upper() + "_PASSWORD"
-        usr = os.getenv(usr_env_var, self._config.get("username"))
-        pwd = os.getenv(pwd_env_var, self._config.get("password"))
-
-        if not usr or not pwd:
-            msg = f"Target {target}: Unknown job provided or no user/password found in environment and config file: {self._job}"
-            logging.error(msg)
-            raise falcon.HTTPInvalidParam(msg, "job")
+            # targets can be repeated or given as a comma separated list
+            targets = [
+                target for value in req.get_param_as_list("target", default=[])
+                for target in value.split(",") if target
+            ]
+            if not targets:
+                logging.error("No target or group parameter provided!")
+                raise falcon.HTTPMissingParam("target")
 
-        logging.debug(f"Target {target}: Using user {usr}")
+        # every server is only scraped once
+        targets = list(dict.fromkeys(targets))
 
-        with RedfishMetricsCollector(
-            self._config,
-            target = target,
-            host = host,
-            usr = usr,
-            pwd = pwd,
-            metrics_type = self.metrics_type
-        ) as registry:
+        if not job:
+            logging.error("No job provided!")
+            raise falcon.HTTPMissingParam("job")
 
-            # open a session with the remote board
-            registry.get_session()
+        logging.debug(f"Received {len(targets)} targets for {metrics_type} metrics with job {job}")
+        return targets, job, metrics_type
 
-            try:
-                # collect the actual metrics
-                resp.text = generate_latest(registry)
-                resp.status = falcon.HTTP_200
+    def on_get(self, req, resp):
+        targets, job, metrics_type = self._get_params(req)
+
+        results = self._executor.map(lambda target: self._scrape(target, job, metrics_type), targets)
+        metrics = merge_metric_families(results)
+
+        resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        resp.stream = (generate_latest(StaticCollector([metric])) for metric in metrics)
+        resp.status = falcon.HTTP_200
+
+    def _scrape(self, target, job, metrics_type):
+        # a failing server must not fail the whole batch, it is reported with redfish_up 0
+        try:
+            target_ip, host = resolve_target(target, self._dns_cache)
+            usr, pwd = get_credentials(self._config, job, target)
+
+            return collect_metric_families(
+                self._config,
+                target = target_ip,
+                host = host,
+                usr = usr,
+                pwd = pwd,
+                metrics_type = metrics_type,
+                session_pool = self._session_pool
+            )
+
+        except falcon.HTTPError as err:
+            logging.error(f"Target {target}: Batch scrape failed: {err.description}")
+
+        except Exception:
+            logging.error(f"Target {target}: Batch scrape failed: {traceback.format_exc()}")
 
-            except Exception as err:
-                message = f"Exception: {traceback.format_exc()}"
-                logging.error(f"Target {target}: {message}")
-                raise falcon.HTTPBadRequest("Bad Request", message)
+        return down_metrics(target)
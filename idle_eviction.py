@@ -0,0 +1,29 @@
+import time
+
+# per-target state of servers not used for this many seconds is removed, checked at most every EVICTION_INTERVAL
+IDLE_TIMEOUT = 3600
+EVICTION_INTERVAL = 60
+
+class IdleEviction(object):
+    """Removes the entries of a dict by target that are idle, e.g. of ad-hoc calls or /batch groups, and their metric labels."""
+
+    def __init__(self, entries, idle, metrics=()):
+        self.entries = entries
+        self.idle = idle
+        self.metrics = metrics
+        self._last = 0
+
+    def run(self, now=None):
+        # called with every use of the entries, the owner of the dict holds its lock
+        now = now or time.time()
+        if now - self._last <= EVICTION_INTERVAL:
+            return
+        self._last = now
+
+        for target in [target for target, entry in self.entries.items() if self.idle(entry, now)]:
+            del self.entries[target]
+            for metric in self.metrics:
+                try:
+                    metric.remove(target)
+                except KeyError:
+                    pass
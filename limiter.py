@@ -0,0 +1,171 @@
+from prometheus_client import Counter, Gauge
+
+from email.utils import parsedate_to_datetime
+
+import threading
+import time
+
+from idle_eviction import IdleEviction, IDLE_TIMEOUT
+
+concurrency_limit = Gauge(
+    "redfish_exporter_concurrency_limit",
+    "Current limit of the parallel requests to a target",
+    ["target"],
+)
+limit_decreases = Counter(
+    "redfish_exporter_concurrency_limit_decreases",
+    "Times the limit of parallel requests to a target was lowered by reason (throttled or timeout)",
+    ["reason"],
+)
+
+# answers of a BMC which is overloaded
+THROTTLED = (429, 503)
+# attempts of a request the server answers as overloaded
+THROTTLED_ATTEMPTS = 4
+# longest pause of the requests to a target, also if the BMC asks for a longer one
+MAX_PAUSE = 30
+# answers slower than this factor times the usual answer time don't raise the limit
+LATENCY_TOLERANCE = 2
+# seconds the limit stays below the one a BMC was overloaded with
+OVERLOAD_MEMORY = 60
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def retry_after_seconds(value):
+    """Returns the seconds of a Retry-After header, which is either a number of seconds or a date."""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimit(object):
+    """Learns how many parallel requests a BMC takes, halves the limit on overload and raises it by one per round of answers."""
+
+    def __init__(self, target, max_limit):
+        self.target = target
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.paused_until = 0
+        self._latency = None
+        self._last_decrease = 0
+        self._overloaded_at = None
+        self._overloaded_until = 0
+        self.last_used = time.time()
+        concurrency_limit.labels(target).set(max_limit)
+
+    @property
+    def current(self):
+        return max(int(self.limit), 1)
+
+    def pause(self):
+        # seconds to wait until the next request may be sent
+        return max(self.paused_until - time.time(), 0)
+
+    def idle(self, now):
+        return now - self.last_used > IDLE_TIMEOUT and not self._in_flight
+
+    def record(self, status_code, duration, retry_after=None):
+        now = time.time()
+        self.last_used = now
+
+        if status_code in THROTTLED:
+            delay = retry_after_seconds(retry_after)
+            self.paused_until = max(self.paused_until, now + min(delay if delay is not None else 1, MAX_PAUSE))
+            self._decrease(now, "throttled")
+
+        elif status_code == 408:
+            self._decrease(now, "timeout")
+
+        else:
+            # the usual answer time follows drops at once and rises slowly
+            if self._latency is None or duration < self._latency:
+                self._latency = duration
+            else:
+                self._latency += (duration - self._latency) * 0.01
+
+            # a BMC getting slower is near its limit, keep it there
+            if duration <= self._latency * LATENCY_TOLERANCE:
+                self.limit = min(self.limit + 1 / self.limit, self._ceiling(now))
+
+        concurrency_limit.labels(self.target).set(self.current)
+
+    def _decrease(self, now, reason):
+        # requests sent together fail together, count them as one overload
+        if now - self._last_decrease < 1:
+            return
+
+        self._last_decrease = now
+        self._overloaded_at = self.current
+        self._overloaded_until = now + OVERLOAD_MEMORY
+        self.limit = max(self.limit / 2, 1)
+        limit_decreases.labels(reason).inc()
+
+    def _ceiling(self, now):
+        # the limit doesn't grow back to the one the BMC was overloaded with right away
+        if self._overloaded_at and now < self._overloaded_until:
+            return max(self._overloaded_at - 1, 1)
+
+        return self.max_limit
+
+
+class TargetLimiter(AdaptiveLimit):
+    """Limits the number of parallel requests sent to one BMC."""
+
+    def __init__(self, target, limit):
+        super().__init__(target, limit)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while True:
+                pause = self.pause()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.current:
+                    self._condition.wait()
+                else:
+                    break
+
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, status_code, duration, retry_after=None):
+        with self._condition:
+            super().record(status_code, duration, retry_after)
+            self._condition.notify_all()
+
+
+def limiter_eviction(limiters):
+    # limiters without requests in flight are removed once their target is idle
+    return IdleEviction(limiters, lambda limiter, now: limiter.idle(now), [concurrency_limit])
+
+
+_eviction = limiter_eviction(_limiters)
+
+
+def get_limiter(target, limit):
+    # all scrapes of the same target share one limiter
+    with _limiters_lock:
+        _eviction.run()
+
+        limiter = _limiters.get(target)
+        if not limiter or limiter.max_limit != limit:
+            limiter = TargetLimiter(target, limit)
+            _limiters[target] = limiter
+
+        return limiter
@@ -1,5 +1,14 @@
 from handler import metricsHandler
+from handler import batchHandler
+from handler import exporterMetricsHandler
+from handler import tracesHandler
+from handler import targetsHandler
 from handler import welcomePage
+from session_pool import SessionPool
+from cluster import get_cluster
+from persistent_store import get_persistent_store
+from poller import Poller
+from prefork import Master
 
 from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
 from socketserver import ThreadingMixIn
@@ -23,16 +32,53 @@ class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
     """Thread per request HTTP server."""
     pass
 
+def falcon_api(middleware=None, owns=None):
+    # the app of the threads engine and a function stopping its background work
+    # sessions are kept open between scrapes unless session_ttl is set to 0
+    session_pool = None
+    session_ttl = int(config.get("session_ttl", 300))
+    if session_ttl > 0:
+        session_pool = SessionPool(
+            ttl = session_ttl,
+            max_per_target = int(config.get("session_pool_size", 3)),
+            timeout = int(os.getenv("TIMEOUT", config.get('timeout', 10))),
+        )
+
+    # targets listed in the config are scraped in the background and answered from memory
+    poller = None
+    if config.get("polling", {}).get("targets"):
+        poller = Poller(config, session_pool=session_pool, owns=owns)
+        poller.start()
+
+    api = falcon.API(middleware=middleware or [])
+    api.add_route("/health",  metricsHandler(config, metrics_type='health', session_pool=session_pool, poller=poller))
+    api.add_route("/firmware", metricsHandler(config, metrics_type='firmware', session_pool=session_pool, poller=poller))
+    api.add_route("/performance", metricsHandler(config, metrics_type='performance', session_pool=session_pool, poller=poller))
+    api.add_route("/all", metricsHandler(config, metrics_type='all', session_pool=session_pool, poller=poller))
+    api.add_route("/batch", batchHandler(config, session_pool=session_pool))
+    api.add_route("/metrics", exporterMetricsHandler())
+    if config.get("trace_history"):
+        api.add_route("/traces", tracesHandler(config))
+    if get_cluster(config):
+        api.add_route("/targets", targetsHandler(config))
+    api.add_route("/", welcomePage())
+
+    def stop():
+        if poller:
+            poller.stop()
+        if session_pool:
+            session_pool.close()
+        if get_persistent_store(config):
+            get_persistent_store(config).close()
+
+    return api, stop
+
 def falcon_app():
     port = int(os.getenv("LISTEN_PORT", config.get("listen_port", 9200)))
     addr = "0.0.0.0"
     logging.info("Starting Redfish Prometheus Server on Port %s", port)
 
-    api = falcon.API()
-    api.add_route("/health",  metricsHandler(config, metrics_type='health'))
-    api.add_route("/firmware", metricsHandler(config, metrics_type='firmware'))
-    api.add_route("/performance", metricsHandler(config, metrics_type='performance'))
-    api.add_route("/", welcomePage())
+    api, stop = falcon_api()
 
     with make_server(addr, port, api, ThreadingWSGIServer, handler_class=_SilentHandler) as httpd:
         httpd.daemon = True
@@ -40,6 +86,63 @@ def falcon_app():
             httpd.serve_forever()
         except (KeyboardInterrupt, SystemExit):
             logging.info("Stopping Redfish Prometheus Server")
+            stop()
+
+def prefork_app(workers, max_requests):
+    port = int(os.getenv("LISTEN_PORT", config.get("listen_port", 9200)))
+    addr = "0.0.0.0"
+    logging.info("Starting Redfish Prometheus Server with %s worker processes on Port %s", workers, port)
+
+    # every worker builds the app itself, so its background work starts after the fork
+    timeout = int(os.getenv("TIMEOUT", config.get('timeout', 10)))
+    master = Master(addr, port, workers, max_requests, timeout, falcon_api, ThreadingWSGIServer, _SilentHandler)
+    master.run()
+
+def asgi_app():
+    # the asyncio engine needs uvicorn, httpx and greenlet
+    import uvicorn
+    import falcon.asgi
+    from async_handler import asyncMetricsHandler
+    from async_handler import asyncBatchHandler
+    from async_handler import asyncExporterMetricsHandler
+    from async_handler import asyncTracesHandler
+    from async_handler import asyncTargetsHandler
+    from async_handler import asyncWelcomePage
+    from async_handler import clientLifecycle
+    from async_collector import create_client
+
+    port = int(os.getenv("LISTEN_PORT", config.get("listen_port", 9200)))
+    addr = "0.0.0.0"
+    logging.info("Starting Redfish Prometheus Server (asyncio) on Port %s", port)
+
+    # the background poller still runs its scrapes in threads
+    poller = None
+    if config.get("polling", {}).get("targets"):
+        poller = Poller(config)
+        poller.start()
+
+    client = create_client(config)
+
+    api = falcon.asgi.App(middleware=[clientLifecycle(client)])
+    api.add_route("/health",  asyncMetricsHandler(config, metrics_type='health', client=client, poller=poller))
+    api.add_route("/firmware", asyncMetricsHandler(config, metrics_type='firmware', client=client, poller=poller))
+    api.add_route("/performance", asyncMetricsHandler(config, metrics_type='performance', client=client, poller=poller))
+    api.add_route("/all", asyncMetricsHandler(config, metrics_type='all', client=client, poller=poller))
+    api.add_route("/batch", asyncBatchHandler(config, client=client))
+    api.add_route("/metrics", asyncExporterMetricsHandler())
+    if config.get("trace_history"):
+        api.add_route("/traces", asyncTracesHandler(config))
+    if get_cluster(config):
+        api.add_route("/targets", asyncTargetsHandler(config))
+    api.add_route("/", asyncWelcomePage())
+
+    uvicorn.run(api, host=addr, port=port, log_level="warning", access_log=False)
+    logging.info("Stopping Redfish Prometheus Server")
+
+    if poller:
+        poller.stop()
+    if get_persistent_store(config):
+        get_persistent_store(config).close()
 
 def enable_logging(filename, debug):
     # enable logging
@@ -85,6 +188,29 @@ if __name__ == "__main__":
         metavar="FILE",
         required=False
     )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        help="Serve with one thread per request (threads) or with asyncio (asyncio)",
+        choices=["threads", "asyncio"],
+        required=False,
+        default="threads"
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of worker processes of the threads engine, the scrapes of a target are always served by the same one",
+        type=int,
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        "--max-requests",
+        help="Replace a worker process after it has served this many calls, 0 never replaces them",
+        type=int,
+        required=False,
+        default=0
+    )
     parser.add_argument(
         "-d", "--debug", 
         help="Debugging mode", 
@@ -93,6 +219,9 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
+    if args.workers > 1 and args.engine == "asyncio":
+        parser.error("worker processes are only supported by the threads engine")
+
     warnings.filterwarnings("ignore")
 
     enable_logging(args.logging, args.debug)
@@ -107,4 +236,9 @@ if __name__ == "__main__":
             print(f"Config File not found: {err}")
             exit(1)
 
-    falcon_app()
+    if args.engine == "asyncio":
+        asgi_app()
+    elif args.workers > 1:
+        prefork_app(args.workers, args.max_requests)
+    else:
+        falcon_app()
@@ -0,0 +1,169 @@
+from prometheus_client import Counter
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import decoder
+
+store_rows = Counter(
+    "redfish_exporter_persistent_store_rows",
+    "Rows of the on-disk store by kind (response or firmware) and operation (loaded, written or updated)",
+    ["kind", "operation"],
+)
+
+_store = None
+_store_lock = threading.Lock()
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS responses (
+        target TEXT, command TEXT, data BLOB, etag TEXT, size INTEGER, expires REAL, stored REAL,
+        PRIMARY KEY (target, command)
+    )""",
+    """CREATE TABLE IF NOT EXISTS firmware (
+        target TEXT PRIMARY KEY, items BLOB, synced REAL, stored REAL
+    )""",
+]
+
+class PersistentStore(object):
+    """SQLite file keeping the cached responses and firmware inventories across restarts, written in the background."""
+
+    def __init__(self, path, max_age, flush_interval):
+        self.path = path
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self._pending_responses = {}
+        self._pending_expires = {}
+        self._pending_firmware = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._stop = threading.Event()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # the connection is shared by the scrapes loading a target and the flush thread
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db_lock, self._db:
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+        self._thread = threading.Thread(target=self._run, name="persistent-store", daemon=True)
+        self._thread.start()
+
+    def load_responses(self, target):
+        # rows older than max_age are not used any more
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT command, data, etag, size, expires FROM responses WHERE target = ? AND stored > ?",
+                (target, time.time() - self.max_age),
+            ).fetchall()
+
+        store_rows.labels("response", "loaded").inc(len(rows))
+        return [(command, decoder.loads(data), etag, size, expires) for command, data, etag, size, expires in rows]
+
+    def load_firmware(self, target):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT items, synced FROM firmware WHERE target = ? AND stored > ?",
+                (target, time.time() - self.max_age),
+            ).fetchone()
+
+        if not row:
+            return None
+
+        store_rows.labels("firmware", "loaded").inc()
+        items, synced = row
+        return {url: tuple(item) for url, item in decoder.loads(items).items()}, synced
+
+    def put_response(self, target, command, entry):
+        # None removes the response
+        with self._lock:
+            self._pending_responses[(target, command)] = entry
+
+    def put_expires(self, target, command, expires):
+        # a revalidated response only gets its new expiry written, a pending write of the whole response has it already
+        with self._lock:
+            if (target, command) not in self._pending_responses:
+                self._pending_expires[(target, command)] = expires
+
+    def put_firmware(self, target, state):
+        with self._lock:
+            self._pending_firmware[target] = state
+
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            responses, self._pending_responses = self._pending_responses, {}
+            expires = [
+                (expiry, now, target, command)
+                for (target, command), expiry in self._pending_expires.items() if (target, command) not in responses
+            ]
+            self._pending_expires = {}
+            firmware, self._pending_firmware = self._pending_firmware, {}
+
+        with self._db_lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (target, command, decoder.dumps(entry.data), entry.etag, entry.size, entry.expires, now)
+                    for (target, command), entry in responses.items() if entry
+                ],
+            )
+            self._db.executemany(
+                "UPDATE responses SET expires = ?, stored = ? WHERE target = ? AND command = ?", expires
+            )
+            self._db.executemany(
+                "DELETE FROM responses WHERE target = ? AND command = ?",
+                [key for key, entry in responses.items() if not entry],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO firmware VALUES (?, ?, ?, ?)",
+                [(target, decoder.dumps(state.items), state.synced, now) for target, state in firmware.items()],
+            )
+
+            # forget servers that are no longer scraped
+            self._db.execute("DELETE FROM responses WHERE stored <= ?", (now - self.max_age,))
+            self._db.execute("DELETE FROM firmware WHERE stored <= ?", (now - self.max_age,))
+
+        store_rows.labels("response", "written").inc(len(responses))
+        store_rows.labels("response", "updated").inc(len(expires))
+        store_rows.labels("firmware", "written").inc(len(firmware))
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as err:
+                logging.error(f"Failed to write the persistent store {self.path}: {err}")
+
+
+def get_persistent_store(config):
+    # one store for the whole exporter, None if no file is configured
+    global _store
+
+    store_config = config.get("persistent_store", {})
+    path = store_config.get("path")
+    if not path:
+        return None
+
+    with _store_lock:
+        if not _store:
+            logging.info(f"Keeping the discovery and firmware data in {path}")
+            _store = PersistentStore(
+                path,
+                max_age = int(store_config.get("max_age", 86400)),
+                flush_interval = int(store_config.get("flush_interval", 30)),
+            )
+
+        return _store
@@ -0,0 +1,284 @@
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.exposition import generate_latest
+
+from concurrent.futures import ThreadPoolExecutor
+
+import falcon
+import heapq
+import logging
+import threading
+import time
+import traceback
+
+from handler import resolve_target, get_credentials, collect_metrics
+from handler import collect_metric_families, collect_health_phases
+from handler import StaticCollector, METRICS_TYPES
+from cluster import get_cluster
+from dns_cache import get_dns_cache
+from events import EventListener, replace_phase_samples
+
+# polled metrics older than this many intervals are not used, the call scrapes the server itself
+STALE_INTERVALS = 3
+
+class Poller(object):
+    """Scrapes the configured targets in the background and keeps the rendered metrics in memory."""
+
+    def __init__(self, config, session_pool=None, owns=None):
+        self._config = config
+        self._session_pool = session_pool
+        self._dns_cache = get_dns_cache(config)
+        self._cluster = get_cluster(config)
+
+        polling = config.get("polling", {})
+        self._intervals = {"health": 60, "firmware": 21600, "performance": 15}
+        self._intervals.update(polling.get("intervals", {}))
+
+        self._jobs = []
+        for entry in polling.get("targets", []):
+            # with several worker processes every one polls its own targets
+            if owns and not owns(entry["target"]):
+                continue
+
+            job = entry.get("job", config.get("job"))
+            for metrics_type in entry.get("metrics", METRICS_TYPES):
+                self._jobs.append((entry["target"], job, metrics_type))
+
+        # the health data of the polled servers is updated on their events, the polls only reconcile it
+        self._events = polling.get("events", {}).get("enabled", False)
+        self._listeners = {}
+        self._listeners_lock = threading.Lock()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(polling.get("workers", 8)), thread_name_prefix="poller"
+        )
+        self._results = {}
+        self._families = {}
+        self._pending = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        logging.info(f"Polling {len(self._jobs)} target/metrics combinations in the background")
+        threading.Thread(target=self._run, name="poller", daemon=True).start()
+
+        if not self._events:
+            return
+
+        # with a cluster the listeners follow the targets of this replica when the replicas change
+        if self._cluster:
+            self._cluster.subscribe(self._update_listeners)
+            self._update_listeners(self._cluster.shard())
+        else:
+            self._update_listeners(None)
+
+    def stop(self):
+        self._stop.set()
+        with self._listeners_lock:
+            listeners, self._listeners = list(self._listeners.values()), {}
+        for listener in listeners:
+            listener.stop()
+        self._executor.shutdown(wait=False)
+
+    def _update_listeners(self, shard):
+        # listens to the polled health targets in the shard, all of them without a cluster
+        targets = set(entry[0] for entry in shard) if shard is not None else None
+        wanted = set(
+            (target, job) for target, job, metrics_type in self._jobs
+            if metrics_type == "health" and (targets is None or target in targets)
+        )
+
+        with self._listeners_lock:
+            if self._stop.is_set():
+                return
+
+            stopped = [self._listeners.pop(key) for key in set(self._listeners) - wanted]
+            started = []
+            for target, job in wanted - set(self._listeners):
+                listener = EventListener(self._config, target, job, self._on_event, self._dns_cache)
+                self._listeners[(target, job)] = listener
+                started.append(listener)
+
+        for listener in stopped:
+            listener.stop()
+        for listener in started:
+            listener.start()
+
+        if started or stopped:
+            logging.info(f"Listening to the events of {len(self._listeners)} targets ({len(started)} started, {len(stopped)} stopped)")
+
+    def get_metrics(self, target, job, metrics_type):
+        with self._lock:
+            result = self._results.get((target, job, metrics_type))
+
+        if not result:
+            return None
+
+        output, host, polled_at = result
+        if time.time() - polled_at > self._intervals[metrics_type] * STALE_INTERVALS:
+            logging.warning(f"Target {target}: Polled {metrics_type} metrics are outdated, scraping the server.")
+            return None
+
+        age_metrics = GaugeMetricFamily(
+            f"redfish_{metrics_type}_poll_age_seconds",
+            f"Redfish Server Monitoring age of the polled {metrics_type} metrics in seconds",
+            labels = {"host": host},
+        )
+        age_metrics.add_sample(
+            f"redfish_{metrics_type}_poll_age_seconds",
+            value = round(time.time() - polled_at, 2),
+            labels = {"host": host},
+        )
+
+        return output + generate_latest(StaticCollector([age_metrics]))
+
+    def _run(self):
+        # spread the first polls a bit so not all servers are hit at the same moment
+        now = time.time()
+        schedule = [
+            (now + index * 0.1, key) for index, key in enumerate(self._jobs)
+        ]
+        heapq.heapify(schedule)
+
+        while schedule and not self._stop.is_set():
+            due, key = schedule[0]
+            wait = due - time.time()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+
+            heapq.heappop(schedule)
+            heapq.heappush(schedule, (max(due + self._intervals[key[2]], time.time()), key))
+
+            # targets of other replicas are scraped there, the calls for them here are answered live
+            if self._cluster and not self._cluster.owns(key[0]):
+                with self._lock:
+                    self._results.pop(key, None)
+                    self._families.pop(key, None)
+                continue
+
+            with self._lock:
+                if key in self._running and key in self._families:
+                    # an update after an event is running, poll when it is done
+                    self._pending.setdefault(key, set()).add("full")
+                    continue
+                if key in self._running:
+                    logging.warning(f"Target {key[0]}: {key[2]} poll still running, skipping this interval.")
+                    continue
+                self._running.add(key)
+
+            try:
+                self._executor.submit(self._poll, key)
+            except RuntimeError:
+                # the executor is shut down when the exporter stops
+                return
+
+    def _on_event(self, target, job, phases):
+        # called by the event listeners with the health phases to read again
+        key = (target, job, "health")
+        if self._cluster and not self._cluster.owns(target):
+            return
+
+        with self._lock:
+            self._pending.setdefault(key, set()).update(phases)
+            if key in self._running:
+                return
+            self._running.add(key)
+
+        self._submit_pending(key)
+
+    def _submit_pending(self, key):
+        try:
+            self._executor.submit(self._poll_pending, key)
+        except RuntimeError:
+            # the executor is shut down when the exporter stops
+            with self._lock:
+                self._running.discard(key)
+
+    def _poll_pending(self, key):
+        with self._lock:
+            phases = self._pending.pop(key, set())
+
+        # without an earlier result there is nothing to update
+        if "full" in phases or key not in self._families:
+            phases = None
+
+        self._poll(key, phases)
+
+    def _poll(self, key, phases=None):
+        target, job, metrics_type = key
+
+        try:
+            target_ip, host = resolve_target(target, self._dns_cache)
+            usr, pwd = get_credentials(self._config, job, target)
+
+            if phases:
+                self._update_phases(key, target_ip, host, usr, pwd, phases)
+
+            elif self._events and metrics_type == "health":
+                # keep the metric families to update them on events
+                families = collect_metric_families(
+                    self._config,
+                    target = target_ip,
+                    host = host,
+                    usr = usr,
+                    pwd = pwd,
+                    metrics_type = metrics_type,
+                    session_pool = self._session_pool
+                )
+                output = generate_latest(StaticCollector(families))
+
+                with self._lock:
+                    self._families[key] = families
+                    self._results[key] = (output, host, time.time())
+
+            else:
+                output = collect_metrics(
+                    self._config,
+                    target = target_ip,
+                    host = host,
+                    usr = usr,
+                    pwd = pwd,
+                    metrics_type = metrics_type,
+                    session_pool = self._session_pool
+                )
+
+                with self._lock:
+                    self._results[key] = (output, host, time.time())
+
+        except falcon.HTTPError as err:
+            logging.error(f"Target {target}: Polling {metrics_type} metrics failed: {err.description}")
+
+        except Exception:
+            logging.error(f"Target {target}: Polling {metrics_type} metrics failed: {traceback.format_exc()}")
+
+        finally:
+            with self._lock:
+                if not self._pending.get(key):
+                    self._running.discard(key)
+                    return
+
+            # events came in during the poll
+            self._submit_pending(key)
+
+    def _update_phases(self, key, target_ip, host, usr, pwd, phases):
+        logging.info(f"Target {key[0]}: Updating the health phases {', '.join(sorted(phases))} after an event")
+        new_families = collect_health_phases(
+            self._config,
+            target = target_ip,
+            host = host,
+            usr = usr,
+            pwd = pwd,
+            phases = phases,
+            session_pool = self._session_pool
+        )
+        if new_families is None:
+            # the server does not answer, the next poll reports it
+            return
+
+        with self._lock:
+            families = self._families[key]
+            polled_at = self._results[key][2]
+            replace_phase_samples(families, new_families, phases)
+            # the age is the one of the last complete poll
+            self._results[key] = (generate_latest(StaticCollector(families)), host, polled_at)
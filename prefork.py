@@ -0,0 +1,266 @@
+from prometheus_client import Counter, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+
+from handler import StaticCollector, merge_metric_families
+
+import falcon
+import requests
+
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import zlib
+
+worker_requests = Counter(
+    "redfish_exporter_worker_requests",
+    "Calls of a worker process by routing (local, forwarded to the worker owning the target or fallback if it did not answer)",
+    ["routing"],
+)
+
+# header of the calls a worker forwards to another one, they are always answered locally
+FORWARDED_HEADER = "X-Redfish-Exporter-Worker"
+# endpoints scraping the server given in the target parameter
+SCRAPE_PATHS = ("/health", "/firmware", "/performance", "/all")
+# workers stopping sooner after their start are respawned with a delay
+MIN_UPTIME = 1
+# seconds a forwarded call may take longer than the timeout of the exporter before it is scraped locally
+FORWARD_TIMEOUT_MARGIN = 30
+
+def owner(target, workers):
+    """Returns the index of the worker process scraping a target."""
+    return zlib.crc32(target.encode()) % workers
+
+
+class workerRouting:
+    """Sends the scrapes of a target to the worker owning it and collects the exporter metrics of all workers."""
+
+    def __init__(self, index, ports, max_requests, timeout, stop):
+        self._index = index
+        self._ports = ports
+        self._max_requests = max_requests
+        self._timeout = timeout
+        self._stop = stop
+        self._requests = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, req, resp):
+        self._count()
+
+        if req.get_header(FORWARDED_HEADER):
+            worker_requests.labels("local").inc()
+            return
+
+        if req.path == "/metrics":
+            self._gather_metrics(resp)
+            return
+
+        target = req.get_param("target")
+        if req.path not in SCRAPE_PATHS or not target or owner(target, len(self._ports)) == self._index:
+            worker_requests.labels("local").inc()
+            return
+
+        # the owner already holds the sessions, connections and cached responses of the server
+        index = owner(target, len(self._ports))
+        try:
+            answer = self._forward(index, req.relative_uri)
+        except requests.exceptions.RequestException as err:
+            # also a worker that took the call but hangs, which runs into the read timeout
+            logging.warning(f"Target {target}: Worker {index} did not answer, scraping in worker {self._index}: {err}")
+            worker_requests.labels("fallback").inc()
+            return
+
+        worker_requests.labels("forwarded").inc()
+        resp.status = falcon.code_to_http_status(answer.status_code)
+        resp.content_type = answer.headers.get("Content-Type", CONTENT_TYPE_LATEST)
+        resp.data = answer.content
+        resp.complete = True
+
+    def _count(self):
+        # a worker is replaced after max_requests calls, the calls it is serving are finished first
+        if not self._max_requests:
+            return
+
+        with self._lock:
+            self._requests += 1
+            if self._requests == self._max_requests:
+                logging.info(f"Worker {self._index}: Served {self._requests} calls, restarting")
+                self._stop.set()
+
+    def _forward(self, index, uri):
+        # the connect timeout is short, a hanging worker is given up on a while after the timeout of the scrape
+        return requests.get(
+            f"http://127.0.0.1:{self._ports[index]}{uri}",
+            headers={FORWARDED_HEADER: str(self._index)},
+            timeout=(1, self._timeout + FORWARD_TIMEOUT_MARGIN),
+        )
+
+    def _gather_metrics(self, resp):
+        # every worker has its own registry, the samples get the label of the worker they come from
+        results = []
+        for index in range(len(self._ports)):
+            if index == self._index:
+                worker_requests.labels("local").inc()
+                text = generate_latest(REGISTRY).decode()
+            else:
+                try:
+                    text = self._forward(index, "/metrics").text
+                except requests.exceptions.RequestException as err:
+                    logging.debug(f"Worker {index} did not answer the metrics call: {err}")
+                    continue
+
+            metrics = list(text_string_to_metric_families(text))
+            for metric in metrics:
+                metric.samples = [
+                    sample._replace(labels=dict(sample.labels, worker=str(index))) for sample in metric.samples
+                ]
+            results.append(metrics)
+
+        resp.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        resp.data = generate_latest(StaticCollector(merge_metric_families(results)))
+        resp.status = falcon.HTTP_200
+        resp.complete = True
+
+
+class Master(object):
+    """Forks the worker processes serving the listening socket, replaces the ones that stop and restarts all of them one by one on SIGHUP."""
+
+    def __init__(self, addr, port, workers, max_requests, timeout, build_api, server_class, handler_class):
+        self.addr = addr
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self._build_api = build_api
+        self._server_class = server_class
+        self._handler_class = handler_class
+        self._pids = {}
+        self._started = {}
+        self._respawn_at = {}
+        self._recycle = []
+        self._recycling = None
+        self._stopping = False
+
+    def run(self):
+        # the sockets are opened before the fork, so the workers know the ports of each other
+        self._socket = socket.create_server((self.addr, self.port), backlog=128)
+        self._private = [socket.create_server(("127.0.0.1", 0), backlog=128) for _ in range(self.workers)]
+        self._ports = [sock.getsockname()[1] for sock in self._private]
+
+        # all workers wait for the same sockets, the ones that lose the race must not block in accept()
+        for sock in [self._socket] + self._private:
+            sock.setblocking(False)
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        while self._pids:
+            self._reap()
+
+            if not self._stopping:
+                now = time.time()
+                for index in range(self.workers):
+                    if index not in self._pids.values() and self._respawn_at.get(index, 0) <= now:
+                        self._spawn(index)
+
+                if self._recycling is None and self._recycle:
+                    self._recycling = self._recycle.pop(0)
+                    self._signal(self._recycling, signal.SIGHUP)
+
+            time.sleep(0.2)
+
+        logging.info("Stopping Redfish Prometheus Server")
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+        for index in list(self._pids.values()):
+            self._signal(index, signal.SIGTERM)
+
+    def _on_reload(self, signum, frame):
+        logging.info(f"Restarting the {self.workers} worker processes one by one")
+        self._recycle = list(range(self.workers))
+
+    def _signal(self, index, signum):
+        for pid, worker in self._pids.items():
+            if worker == index:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _reap(self):
+        while self._pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+
+            index = self._pids.pop(pid, None)
+            if index is None:
+                continue
+
+            uptime = time.time() - self._started.pop(pid)
+            if status and not self._stopping:
+                logging.warning(f"Worker {index} (pid {pid}) stopped with status {status} after {round(uptime)} seconds")
+            if uptime < MIN_UPTIME:
+                self._respawn_at[index] = time.time() + MIN_UPTIME
+            if index == self._recycling:
+                self._recycling = None
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self._pids[pid] = index
+            self._started[pid] = time.time()
+            return
+
+        try:
+            self._serve(index)
+        except Exception:
+            logging.exception(f"Worker {index} failed")
+            os._exit(1)
+        os._exit(0)
+
+    def _serve(self, index):
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: stop.set())
+
+        # the worker only serves its own private socket
+        for number, sock in enumerate(self._private):
+            if number != index:
+                sock.close()
+
+        logging.info(f"Worker {index} (pid {os.getpid()}) started")
+        api, stop_api = self._build_api(
+            middleware = [workerRouting(index, self._ports, self.max_requests, self.timeout, stop)],
+            owns = lambda target: owner(target, self.workers) == index,
+        )
+
+        servers = []
+        for sock, addr, port in ((self._socket, self.addr, self.port), (self._private[index], "127.0.0.1", self._ports[index])):
+            server = self._server_class((addr, port), self._handler_class, bind_and_activate=False)
+            server.socket.close()
+            server.socket = sock
+            server.server_name = addr
+            server.server_port = port
+            server.setup_environ()
+            server.set_app(api)
+            threading.Thread(target=server.serve_forever, name=f"server-{port}", daemon=True).start()
+            servers.append(server)
+
+        while not stop.wait(1):
+            pass
+
+        # the calls in progress are answered before the worker exits
+        for server in servers:
+            server.shutdown()
+        for server in servers:
+            server.server_close()
+        stop_api()
+        logging.info(f"Worker {index} (pid {os.getpid()}) stopped")
@@ -0,0 +1,190 @@
+from prometheus_client import Counter, Gauge
+
+from collections import OrderedDict
+
+import threading
+import time
+
+from persistent_store import get_persistent_store
+
+cache_requests = Counter(
+    "redfish_exporter_response_cache_requests",
+    "Lookups in the Redfish response cache by result (hit, revalidated or miss)",
+    ["resource_class", "result"],
+)
+cache_evictions = Counter(
+    "redfish_exporter_response_cache_evictions",
+    "Responses removed from the Redfish response cache to stay below its size limit",
+)
+cache_size = Gauge(
+    "redfish_exporter_response_cache_size_bytes",
+    "Size of the responses held in the Redfish response cache",
+)
+cache_entries = Gauge(
+    "redfish_exporter_response_cache_entries",
+    "Number of responses held in the Redfish response cache",
+)
+
+# resources which only change with a firmware update or a reconfiguration
+DEFAULT_TTLS = {
+    "SessionService": 3600,
+    "UpdateService": 3600,
+    "FirmwareInventory": 3600,
+}
+
+RESOURCE_CLASSES = [
+    "Systems", "Chassis", "Managers", "SessionService", "UpdateService", "FirmwareInventory",
+    "EventService", "Processors", "Memory", "MemoryMetrics", "Storage", "StorageControllers",
+    "Drives", "Volumes", "Power", "Thermal", "PowerSubsystem", "ThermalSubsystem",
+    "PowerSupplies", "ThermalMetrics", "EnvironmentMetrics", "NetworkInterfaces", "Metrics", "LogServices",
+]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def resource_class(command):
+    """Returns the kind of Redfish resource an URL points to, e.g. Memory or FirmwareInventory."""
+    path = command.split("?", 1)[0].rstrip("/")
+    if path == "/redfish/v1":
+        return "ServiceRoot"
+
+    # the last well known collection in the path names the class of the resource
+    for segment in reversed(path.split("/")):
+        if segment in RESOURCE_CLASSES:
+            return segment
+
+    return "Other"
+
+
+class CachedResponse(object):
+    """A parsed Redfish response with its ETag and expiry time."""
+
+    def __init__(self, data, etag, size, expires):
+        self.data = data
+        self.etag = etag
+        self.size = size
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """Per URL cache of Redfish responses with a TTL per resource class, bounded by size with LRU eviction."""
+
+    def __init__(self, max_bytes, ttls, store=None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._store = store
+        self._loaded = set()
+
+    def ttl(self, command):
+        return self.ttls.get(resource_class(command), 0)
+
+    def get(self, target, command):
+        # returns the cached response and whether it can be used without asking the server
+        if not self.loaded(target):
+            self.load(target)
+
+        with self._lock:
+            entry = self._entries.get((target, command))
+            if entry:
+                self._entries.move_to_end((target, command))
+
+        if not entry:
+            return None, False
+
+        if entry.expires > time.time():
+            cache_requests.labels(resource_class(command), "hit").inc()
+            return entry, True
+
+        return entry, False
+
+    def revalidated(self, target, command, entry):
+        # the server answered 304 Not Modified to If-None-Match
+        cache_requests.labels(resource_class(command), "revalidated").inc()
+        entry.expires = time.time() + self.ttl(command)
+        if self._store:
+            self._store.put_expires(target, command, entry.expires)
+
+    def put(self, target, command, data, etag, size):
+        # the response had to be fetched from the server
+        cache_requests.labels(resource_class(command), "miss").inc()
+
+        ttl = self.ttl(command)
+        if size > self.max_bytes:
+            return
+
+        # without an ETag and without a TTL the response can't be used again
+        if not ttl and not etag:
+            self.remove(target, command)
+            return
+
+        entry = CachedResponse(data, etag, size, time.time() + ttl)
+        self._add(target, command, entry)
+        if self._store:
+            self._store.put_response(target, command, entry)
+
+    def remove(self, target, command):
+        with self._lock:
+            old = self._entries.pop((target, command), None)
+            if old:
+                self._size -= old.size
+                self._update_size()
+
+        # only a response that was cached can be in the store
+        if self._store and old:
+            self._store.put_response(target, command, None)
+
+    def _add(self, target, command, entry):
+        with self._lock:
+            old = self._entries.pop((target, command), None)
+            if old:
+                self._size -= old.size
+
+            self._entries[(target, command)] = entry
+            self._size += entry.size
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                cache_evictions.inc()
+
+            self._update_size()
+
+    def loaded(self, target):
+        return not self._store or target in self._loaded
+
+    def load(self, target):
+        # the responses of a target from before a restart are read with its first scrape
+        with self._lock:
+            if target in self._loaded:
+                return
+            self._loaded.add(target)
+
+        for command, data, etag, size, expires in self._store.load_responses(target):
+            with self._lock:
+                known = (target, command) in self._entries
+            if not known:
+                self._add(target, command, CachedResponse(data, etag, size, expires))
+
+    def _update_size(self):
+        cache_size.set(self._size)
+        cache_entries.set(len(self._entries))
+
+
+def get_response_cache(config):
+    # one cache for all scrapes, None if it is switched off
+    global _cache
+
+    cache_config = config.get("cache", {})
+    max_bytes = int(cache_config.get("max_bytes", 64 * 1024 * 1024))
+    if not max_bytes:
+        return None
+
+    with _cache_lock:
+        if not _cache:
+            _cache = ResponseCache(max_bytes, cache_config.get("ttl", {}), get_persistent_store(config))
+
+        return _cache
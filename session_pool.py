@@ -0,0 +1,140 @@
+from prometheus_client import Counter, Gauge
+
+import requests
+import logging
+import threading
+import time
+
+pool_hits = Counter(
+    "redfish_exporter_session_pool_hits",
+    "Redfish sessions reused from the session pool",
+)
+pool_misses = Counter(
+    "redfish_exporter_session_pool_misses",
+    "Scrapes that had to log in because no pooled session was available",
+)
+pool_evictions = Counter(
+    "redfish_exporter_session_pool_evictions",
+    "Redfish sessions removed from the session pool",
+    ["reason"],
+)
+pool_idle_sessions = Gauge(
+    "redfish_exporter_session_pool_idle_sessions",
+    "Idle Redfish sessions currently held in the session pool",
+)
+active_sessions = Gauge(
+    "redfish_exporter_active_sessions",
+    "Redfish sessions the exporter is logged in with, in use by a scrape or idle in the session pool",
+)
+
+class PooledSession(object):
+    """A logged in Redfish session together with its requests session."""
+
+    def __init__(self, target, username, session, auth_token, session_url):
+        self.target = target
+        self.username = username
+        self.session = session
+        self.auth_token = auth_token
+        self.session_url = session_url
+        self.last_used = time.time()
+
+
+class SessionPool(object):
+    """Keeps Redfish sessions alive across scrapes, keyed by (target, user)."""
+
+    def __init__(self, ttl, max_per_target, timeout):
+        self.ttl = ttl
+        self.max_per_target = max_per_target
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, target, username):
+        expired = self._evict_idle()
+        pooled = None
+
+        with self._lock:
+            idle = self._idle.get((target, username))
+            if idle:
+                pooled = idle.pop()
+            self._update_size()
+
+        self._logout(expired, "idle")
+
+        if pooled:
+            logging.debug(f"Target {target}: Reusing pooled Redfish session.")
+            pool_hits.inc()
+        else:
+            pool_misses.inc()
+
+        return pooled
+
+    def release(self, target, username, session, auth_token, session_url):
+        pooled = PooledSession(target, username, session, auth_token, session_url)
+        overflow = []
+
+        with self._lock:
+            idle = self._idle.setdefault((target, username), [])
+            idle.append(pooled)
+            # keep the most recently used sessions, the BMC may limit concurrent sessions
+            while len(idle) > self.max_per_target:
+                overflow.append(idle.pop(0))
+            self._update_size()
+
+        logging.debug(f"Target {target}: Returned Redfish session to the pool.")
+        self._logout(overflow, "overflow")
+        self._logout(self._evict_idle(), "idle")
+
+    def discard(self, pooled, reason):
+        logging.debug(f"Target {pooled.target}: Discarding pooled Redfish session ({reason}).")
+        pool_evictions.labels(reason).inc()
+        active_sessions.dec()
+        pooled.session.close()
+
+    def close(self):
+        with self._lock:
+            sessions = [pooled for idle in self._idle.values() for pooled in idle]
+            self._idle = {}
+            self._update_size()
+
+        self._logout(sessions, "shutdown")
+
+    def _evict_idle(self):
+        expired = []
+        deadline = time.time() - self.ttl
+
+        with self._lock:
+            for key in list(self._idle):
+                idle = self._idle[key]
+                expired.extend(pooled for pooled in idle if pooled.last_used < deadline)
+                self._idle[key] = [pooled for pooled in idle if pooled.last_used >= deadline]
+                if not self._idle[key]:
+                    del self._idle[key]
+            self._update_size()
+
+        return expired
+
+    def _update_size(self):
+        pool_idle_sessions.set(sum(len(idle) for idle in self._idle.values()))
+
+    def _logout(self, sessions, reason):
+        for pooled in sessions:
+            logging.debug(f"Target {pooled.target}: Deleting pooled Redfish session ({reason}).")
+            pool_evictions.labels(reason).inc()
+            active_sessions.dec()
+
+            try:
+                response = pooled.session.delete(
+                    f"https://{pooled.target}{pooled.session_url}",
+                    headers={"X-Auth-Token": pooled.auth_token},
+                    verify=False,
+                    timeout=self._timeout,
+                )
+                response.close()
+                if not response:
+                    logging.warning(f"Target {pooled.target}: Failed to delete pooled session: {response.status_code}")
+
+            except requests.exceptions.RequestException as err:
+                logging.warning(f"Target {pooled.target}: Failed to delete pooled session: {err}")
+
+            pooled.session.close()
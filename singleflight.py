@@ -0,0 +1,95 @@
+from prometheus_client import Counter
+
+import asyncio
+import threading
+
+coalesced_requests = Counter(
+    "redfish_exporter_coalesced_requests",
+    "Scrapes answered with the result of an identical scrape that was already running",
+    ["metrics_type"],
+)
+
+# longest wait for the result of a running call, a leader that never finishes must not hold the others forever
+WAIT_TIMEOUT = 300
+
+class _Call(object):
+    """A running call and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time, callers arriving meanwhile get the same result."""
+
+    def __init__(self, timeout=WAIT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        # returns the call for the key and whether the caller has to run it
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                return call, False
+
+            call = _Call()
+            self._calls[key] = call
+            return call, True
+
+    def wait(self, call):
+        if not call.done.wait(self.timeout):
+            raise TimeoutError(f"The running call did not finish within {self.timeout} seconds")
+        if call.error:
+            raise call.error
+        return call.result
+
+    def finish(self, key, call, result=None, error=None):
+        call.result = result
+        call.error = error
+        with self._lock:
+            # a call is only finished once, a later call with the same key may already run
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def do(self, key, function):
+        # returns the result and whether it was shared with another caller
+        call, leader = self.begin(key)
+        if not leader:
+            return self.wait(call), True
+
+        try:
+            result = function()
+        except Exception as err:
+            self.finish(key, call, error=err)
+            raise
+
+        self.finish(key, call, result=result)
+        return result, False
+
+
+class AsyncSingleFlight(object):
+    """SingleFlight for coroutines running on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, function):
+        call = self._calls.get(key)
+        if call:
+            return await asyncio.shield(call), True
+
+        call = asyncio.ensure_future(function())
+        self._calls[key] = call
+        try:
+            return await asyncio.shield(call), False
+        finally:
+            if call.done():
+                del self._calls[key]
+            else:
+                # the leader was cancelled, let the followers still finish
+                call.add_done_callback(lambda _: self._calls.pop(key, None))
@@ -0,0 +1,143 @@
+try:
+    # the asyncio engine runs the parts of a scrape in greenlets of the same thread
+    from greenlet import getcurrent as _current
+except ImportError:
+    from threading import get_ident as _current
+
+from collections import deque
+
+import contextlib
+import functools
+import threading
+import time
+
+_store = None
+_store_lock = threading.Lock()
+
+class Span(object):
+    """A timed phase of a scrape with the phases it is made of."""
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.start = time.time()
+        self.duration = None
+        self.children = []
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "offset": round(self.start - origin, 4),
+            "duration": round(self.duration, 4) if self.duration is not None else None,
+            "spans": [child.to_dict(origin) for child in self.children],
+        }
+
+
+class Trace(object):
+    """The spans of one scrape, the span opened last in a thread or greenlet is the parent of the next one."""
+
+    def __init__(self, target, host, metrics_type):
+        self.target = target
+        self.host = host
+        self.metrics_type = metrics_type
+        self.root = Span("scrape")
+        self._stacks = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        key = _current()
+        with self._lock:
+            stack = self._stacks.setdefault(key, [])
+            parent = stack[-1] if stack else self.root
+            span = Span(name, parent)
+            parent.children.append(span)
+            stack.append(span)
+
+        try:
+            yield span
+        finally:
+            with self._lock:
+                stack.pop()
+                if not stack:
+                    del self._stacks[key]
+            span.finish()
+
+    def phases(self):
+        # (name, duration) of all finished spans, depth first
+        result = []
+
+        def walk(span):
+            for child in span.children:
+                if child.duration is not None:
+                    result.append((child.name, child.duration))
+                walk(child)
+
+        walk(self.root)
+        return result
+
+    def finish(self):
+        self.root.finish()
+
+    def to_dict(self):
+        return {
+            "target": self.target,
+            "host": self.host,
+            "metrics_type": self.metrics_type,
+            "start": self.root.start,
+            "duration": round(self.root.duration, 4) if self.root.duration is not None else None,
+            "spans": [span.to_dict(self.root.start) for span in self.root.children],
+        }
+
+
+class TraceStore(object):
+    """Keeps the traces of the most recent scrapes."""
+
+    def __init__(self, size):
+        self._traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def slowest(self, limit, target=None, metrics_type=None):
+        with self._lock:
+            traces = list(self._traces)
+
+        traces = [
+            trace for trace in traces
+            if (not target or target in (trace.target, trace.host))
+            and (not metrics_type or trace.metrics_type == metrics_type)
+        ]
+        traces.sort(key=lambda trace: trace.root.duration or 0, reverse=True)
+        return traces[:limit]
+
+
+def traced(name):
+    """Runs a method of a collector in a span of the trace of its scrape."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            with self.trace.span(name):
+                return function(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_trace_store(config):
+    # one store for all scrapes, None if the trace history is switched off
+    global _store
+
+    size = int(config.get("trace_history", 0))
+    if not size:
+        return None
+
+    with _store_lock:
+        if not _store:
+            _store = TraceStore(size)
+
+        return _store
@@ -0,0 +1,119 @@
+from prometheus_client import Counter, Gauge
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPSConnection
+from urllib3.connectionpool import HTTPSConnectionPool
+
+import logging
+import threading
+import time
+
+from idle_eviction import IdleEviction, IDLE_TIMEOUT
+
+opened_connections = Counter(
+    "redfish_exporter_bmc_connections",
+    "TLS connections opened to the Redfish APIs of the servers",
+)
+open_transports = Gauge(
+    "redfish_exporter_bmc_transports",
+    "Servers the exporter keeps a connection pool for",
+)
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+# address of the server -> certificate of the last TLS connection in DER format and the time it was last stored or read
+_peer_certificates = {}
+_peer_certificates_lock = threading.Lock()
+# the certificates are removed with the connection pool of the server, or when the asyncio engine no longer scrapes it
+_peer_eviction = IdleEviction(_peer_certificates, lambda entry, now: now - entry[1] > IDLE_TIMEOUT)
+
+def _address(host, port):
+    # the form of the target parameter, the port is only added if it is not the default one
+    return host if port in (None, 443) else f"{host}:{port}"
+
+
+def store_peer_certificate(target, certificate):
+    if certificate:
+        with _peer_certificates_lock:
+            _peer_eviction.run()
+            _peer_certificates[target] = [certificate, time.time()]
+
+
+def peer_certificate(target):
+    """Returns the certificate the server presented on the last connection of the exporter in DER format, None if there was none."""
+    with _peer_certificates_lock:
+        entry = _peer_certificates.get(target)
+        if not entry:
+            return None
+
+        entry[1] = time.time()
+        return entry[0]
+
+
+class CapturingHTTPSConnection(HTTPSConnection):
+    """HTTPS connection remembering the certificate of the server."""
+
+    def connect(self):
+        super().connect()
+        opened_connections.inc()
+        # the certificate is also available if it was not verified
+        store_peer_certificate(_address(self.host, self.port), self.sock.getpeercert(binary_form=True))
+
+
+class CapturingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CapturingHTTPSConnection
+
+
+class TargetAdapter(HTTPAdapter):
+    """Connection pool to one server shared by all scrapes of it, closing the requests session of a scrape keeps the connections open."""
+
+    def __init__(self, target, pool_size):
+        self.target = target
+        self.pool_size = pool_size
+        self.last_used = time.time()
+        super().__init__(pool_connections=1, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(
+            self.poolmanager.pool_classes_by_scheme, https=CapturingHTTPSConnectionPool
+        )
+
+    def send(self, request, **kwargs):
+        self.last_used = time.time()
+        return super().send(request, **kwargs)
+
+    def close(self):
+        # called by requests.Session.close() at the end of every scrape
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+def get_transport(config, target):
+    # all scrapes of the same target share one connection pool, pools of servers no longer scraped are closed
+    pool_size = int(config.get("connection_pool_size", max(int(config.get("max_concurrent_requests", 4)), 10)))
+    idle_timeout = int(config.get("connection_idle_timeout", 300))
+    now = time.time()
+
+    with _transports_lock:
+        expired = [
+            transport for transport in _transports.values()
+            if now - transport.last_used > idle_timeout or transport.target == target and transport.pool_size != pool_size
+        ]
+        for transport in expired:
+            logging.debug(f"Target {transport.target}: Closing the connections to the server.")
+            del _transports[transport.target]
+            with _peer_certificates_lock:
+                _peer_certificates.pop(transport.target, None)
+            transport.shutdown()
+
+        transport = _transports.get(target)
+        if not transport:
+            transport = TargetAdapter(target, pool_size)
+            _transports[target] = transport
+
+        open_transports.set(len(_transports))
+        return transport